@@ -1,9 +1,24 @@
+import time
+_IMPORT_START = time.perf_counter()
+
 import streamlit as st
-import pandas as pd
-import joblib
 import base64
+import os
 
+import audit
+from inference import (DIFFERENTIAL_SIZE, pack_features, record_startup, shared_engine, symptoms_to_features,
+                       warm_up)
+from metrics import start_file_exporter, timed
+from sms_codec import render_sms
 from triage_engine import triage
+from triage_rules import current_rules
+
+# Only the first run in a process pays for the imports; later reruns keep that value
+record_startup("app_imports", time.perf_counter() - _IMPORT_START)
+
+# Optional Prometheus textfile export, e.g. HEALTHMATE_METRICS_FILE=/var/lib/node_exporter/healthmate.prom
+if os.environ.get("HEALTHMATE_METRICS_FILE"):
+    start_file_exporter(os.environ["HEALTHMATE_METRICS_FILE"])
 
 # rebuild-trigger-1
 
@@ -21,11 +36,15 @@ def get_base64_of_bin_file(bin_file):
         data = f.read()
     return base64.b64encode(data).decode()
 
-if "LOGO_B64" not in st.session_state:
+# Encoded once per process and shared by every session (not copied into each session_state)
+@st.cache_resource(show_spinner=False)
+def logo_b64() -> str:
     try:
-        st.session_state["LOGO_B64"] = get_base64_of_bin_file("logo.png")
-    except:
-        st.session_state["LOGO_B64"] = ""
+        return get_base64_of_bin_file("logo.png")
+    except OSError:
+        return ""
+
+LOGO_B64 = logo_b64()
 
 
 # -----------------------------
@@ -190,6 +209,14 @@ language = st.sidebar.selectbox(
 )
 T = LANG[language]
 
+# Symptom text is also matched against the selected language's synonym table
+LANG_CODES = {
+    "English": None,
+    "Luganda (demo)": "lg",
+    "Swahili (demo)": "sw",
+    "Runyankole/Rukiga (demo)": "nyn",
+}
+
 st.sidebar.markdown("### 🩺 About HealthMate AI")
 st.sidebar.write(
     "HealthMate AI is a safety-first, AI-powered symptom triage assistant "
@@ -221,19 +248,53 @@ with st.sidebar.expander("🛣️ Roadmap"):
 # -----------------------------
 # Model loading + symptom feature conversion
 # -----------------------------
-@st.cache_resource
+# One engine per process, memory-mapped from data/cache when a compiled copy
+# exists. When retraining swaps in a new model.joblib it is reloaded, and the
+# mtime below keys the cached pipeline stages so old results are not reused.
+MODEL_FILE = "model.joblib"
+
+
+def model_stamp() -> int:
+    return os.stat(MODEL_FILE).st_mtime_ns
+
+
 def load_model():
-    payload = joblib.load("model.joblib")
-    return payload["model"], payload["feature_columns"]
+    engine = shared_engine(MODEL_FILE)
+    return engine, engine.feature_columns
+
+
+# Once per process: load the model, compile the matchers and build the referral
+# index in the background while the first visitor is still typing
+@st.cache_resource(show_spinner=False)
+def start_warm_up():
+    return warm_up(MODEL_FILE, tuple(LANG_CODES.values()))
 
-def symptoms_to_features(symptom_text: str, feature_columns):
-    text = (symptom_text or "").lower()
-    row = {c: 0 for c in feature_columns}
-    for c in feature_columns:
-        token = c.replace("_", " ")
-        if token in text or c in text:
-            row[c] = 1
-    return pd.DataFrame([row])
+start_warm_up()
+
+
+# Pipeline stages are cached on their actual inputs, so a rerun caused by an
+# unrelated widget or a language switch only re-renders text. The rule version
+# is part of the key, so a reloaded rules file takes effect immediately
+# (arguments starting with "_" are not hashed by st.cache_data).
+@st.cache_data(max_entries=1024, show_spinner=False)
+def analyse_symptoms(symptom_text: str, language_code, rule_version: str, _rules, stamp: int):
+    _, feature_columns = load_model()
+    features, flags = symptoms_to_features(symptom_text, feature_columns, language_code, _rules)
+    return pack_features(features), flags
+
+
+# Ranked differential from a single model pass: ((prognosis, calibrated probability), ...)
+@st.cache_data(max_entries=1024, show_spinner=False)
+def predict_condition(feature_mask: int, stamp: int) -> tuple:
+    model, _ = load_model()
+    return tuple(model.top_k(feature_mask, DIFFERENTIAL_SIZE))
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def triage_case(flags: tuple, answers: tuple, age: int, sex: str, pregnant: bool, location, confidence: float,
+                rule_version: str, _rules):
+    return triage(symptom_text="", age=age, sex=sex, pregnant=pregnant, answers=dict(answers),
+                  flags=dict(flags), rules=_rules, location=location, confidence=confidence)
 
 
 # -----------------------------
@@ -242,7 +303,7 @@ def symptoms_to_features(symptom_text: str, feature_columns):
 st.markdown(f"""
 <div class="hm-header" style="display:flex; align-items:center; gap:16px;">
   <div style="background:white; padding:10px; border-radius:12px;">
-    <img src="data:image/png;base64,{st.session_state.get('LOGO_B64','')}" width="90" />
+    <img src="data:image/png;base64,{LOGO_B64}" width="90" />
   </div>
   <div>
     <h1 style="margin:0;">{T["title"]}</h1>
@@ -304,6 +365,12 @@ if sex == "Female":
 else:
     col3.write("")
 
+# Optional: with a location, referrals are the nearest facilities for the triage level
+with st.expander("📍 Location for referrals (optional)"):
+    cLat, cLon = st.columns(2)
+    lat = cLat.number_input("Latitude", min_value=-90.0, max_value=90.0, value=None, format="%.4f")
+    lon = cLon.number_input("Longitude", min_value=-180.0, max_value=180.0, value=None, format="%.4f")
+
 st.subheader(T["followup"])
 c1, c2 = st.columns(2)
 
@@ -327,21 +394,61 @@ st.divider()
 # -----------------------------
 # Run inference + show results
 # -----------------------------
+with timed("parse"):
+    case = {
+        "symptom_text": symptom_text,
+        "age": int(age),
+        "sex": sex,
+        "pregnant": pregnant,
+        "answers": dict(answers),
+        "language": LANG_CODES[language],
+        "location": (float(lat), float(lon)) if lat is not None and lon is not None else None,
+    }
+
 if st.button(T["run"], type="primary", use_container_width=True):
     if not symptom_text.strip():
         st.warning("Please describe symptoms first.")
+        st.session_state.pop("case", None)
     else:
-        # ML prediction
-        model, feature_columns = load_model()
-        X_user = symptoms_to_features(symptom_text, feature_columns)
-        pred = model.predict(X_user)[0]
-
-        st.subheader(T["ml_title"])
-        st.write(f"**{T['ml_label']}:** {pred}")
+        st.session_state["case"] = case
+        st.session_state["case_audited"] = False
+
+# Results stay on screen for the submitted case across reruns
+submitted = st.session_state.get("case")
+if submitted:
+    if any(submitted[k] != case[k] for k in ("symptom_text", "age", "sex", "pregnant", "answers", "location")):
+        st.caption("Inputs changed — press the button again to update the guidance.")
+
+    rules = current_rules()
+    stamp = model_stamp()
+
+    # ML prediction
+    feature_mask, flags = analyse_symptoms(submitted["symptom_text"], submitted["language"], rules.version, rules, stamp)
+    differential = predict_condition(feature_mask, stamp)
+    pred, confidence = differential[0]
+
+    st.subheader(T["ml_title"])
+    st.write(f"**{T['ml_label']}:** {pred}")
+    st.caption("Differential (calibrated probability)")
+    for label, p in differential:
+        st.write(f"• {label} — {p:.0%}")
+
+    # Safety-first triage (a low model confidence can raise the level, see data/triage_rules.json)
+    res = triage_case(
+        tuple(sorted(flags.items())), tuple(sorted(submitted["answers"].items())),
+        submitted["age"], submitted["sex"], submitted["pregnant"], submitted["location"], confidence,
+        rules.version, rules
+    )
 
-        # Safety-first triage
-        res = triage(symptom_text=symptom_text, age=int(age), sex=sex, pregnant=pregnant, answers=answers)
+    # One audit record per submitted case, not per rerun; queued, never written inline
+    if not st.session_state.get("case_audited", True):
+        st.session_state["case_audited"] = True
+        audit.record("app", res, symptom_text=submitted["symptom_text"], age=submitted["age"],
+                     sex=submitted["sex"], pregnant=submitted["pregnant"], answers=submitted["answers"],
+                     flags=flags, prediction=pred, language=submitted["language"],
+                     location=submitted["location"], differential=[list(d) for d in differential])
 
+    with timed("render"):
         st.subheader(T["result"])
         st.metric(T["triage_level"], res.title)
 
@@ -369,11 +476,13 @@ if st.button(T["run"], type="primary", use_container_width=True):
         for d in res.disclaimers:
             st.caption("• " + d)
 
-        # Reset button
-        if st.button(T["reset"], use_container_width=True):
-            st.session_state["symptoms"] = ""
-            st.rerun()
-
-        st.info("Tip for demo: Try 'chest tightness + difficulty breathing' to trigger urgent triage.")
+        # What a feature phone would receive (single SMS)
+        st.code(render_sms(res), language=None)
 
+    # Reset button
+    if st.button(T["reset"], use_container_width=True):
+        st.session_state["symptoms"] = ""
+        st.session_state.pop("case", None)
+        st.rerun()
 
+    st.info("Tip for demo: Try 'chest tightness + difficulty breathing' to trigger urgent triage.")
@@ -0,0 +1,239 @@
+import atexit
+import glob
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from metrics import add_collector, inc
+
+# Override with HEALTHMATE_AUDIT_DIR=/var/log/healthmate; HEALTHMATE_AUDIT=0 turns auditing off
+AUDIT_DIR = os.environ.get(
+    "HEALTHMATE_AUDIT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "audit"),
+)
+ENABLED = os.environ.get("HEALTHMATE_AUDIT", "1") != "0"
+
+AUDIT_FILE = "audit.jsonl"
+MAX_QUEUE = 10000           # records held in memory before new ones are dropped
+MAX_BATCH = 512             # records written per write() call
+SYNC_INTERVAL_S = 1.0       # at most this much acknowledged audit data is lost on a crash
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 10           # audit.jsonl.1 (newest) ... audit.jsonl.10 (oldest)
+
+_STOP = object()
+
+
+def audit_record(source: str, result, symptom_text: str, age: int, sex: str, pregnant: bool,
+                 answers: Dict[str, bool], flags: Dict[str, bool], prediction: Optional[str] = None,
+                 language: Optional[str] = None, location: Optional[Tuple[float, float]] = None,
+                 **extra: Any) -> Dict[str, Any]:
+    # One JSON-friendly line per triage: what came in, what fired and what was answered
+    return {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "source": source,
+        "symptom_text": symptom_text,
+        "language": language,
+        "age": age,
+        "sex": sex,
+        "pregnant": bool(pregnant),
+        "answers": sorted(k for k, v in answers.items() if v),
+        "location": list(location) if location is not None else None,
+        "flags": sorted(k for k, v in flags.items() if v),
+        "score": result.score,
+        "level": result.level,
+        "reason_ids": list(result.reason_ids),
+        "referrals": [row for row, _ in result.referrals],
+        "prediction": prediction,
+        "rule_version": result.rule_version,
+        **extra,
+    }
+
+
+# -----------------------------
+# Background batched writer
+# -----------------------------
+# record() only puts a dict on a bounded in-memory queue, so a request never
+# waits on the disk; when the queue is full the record is dropped and counted
+# rather than blocking. A single daemon thread drains the queue in batches,
+# appends JSON lines to AUDIT_FILE, fsyncs at most every `sync_interval_s` and
+# rotates the file by size. close() (also run at exit) writes what is queued.
+class AuditSink:
+    def __init__(self, directory: str = AUDIT_DIR, max_queue: int = MAX_QUEUE, max_batch: int = MAX_BATCH,
+                 sync_interval_s: float = SYNC_INTERVAL_S, max_bytes: int = MAX_BYTES,
+                 backup_count: int = BACKUP_COUNT):
+        self.directory = directory
+        self.path = os.path.join(directory, AUDIT_FILE)
+        self.max_batch = max_batch
+        self.sync_interval_s = sync_interval_s
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.written = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._thread = threading.Thread(target=self._run, name="healthmate-audit-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def record(self, record: Dict[str, Any], block: bool = False) -> bool:
+        # -> False when the record was dropped (queue full or sink closed). Requests
+        # never block; batch jobs pass block=True to wait for room instead of dropping.
+        if not self._closed:
+            try:
+                self._queue.put(record, block=block)
+                return True
+            except queue.Full:
+                pass
+        self.dropped += 1
+        inc("healthmate_audit_records_total", help="Audit records by outcome.", result="dropped")
+        return False
+
+    def close(self, timeout_s: float = 5.0) -> None:
+        # Flush everything queued so far and stop the writer; safe to call twice
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._queue.put(_STOP, timeout=timeout_s)
+        except queue.Full:
+            pass
+        self._thread.join(timeout_s)
+
+    def _run(self) -> None:
+        next_sync = time.monotonic() + self.sync_interval_s
+        dirty = False
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, next_sync - time.monotonic()) if dirty else None)
+            except queue.Empty:
+                item = None
+
+            batch: List[Dict[str, Any]] = []
+            stop = item is _STOP
+            if item is not None and not stop:
+                batch.append(item)
+                while len(batch) < self.max_batch:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stop = True
+                        break
+                    batch.append(item)
+
+            if batch:
+                self._write(batch)
+                dirty = True
+            if dirty and (stop or time.monotonic() >= next_sync):
+                self._sync()
+                dirty = False
+                next_sync = time.monotonic() + self.sync_interval_s
+            if stop:
+                self._file.close()
+                return
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch).encode("utf-8")
+        try:
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._size += len(data)
+        except OSError as exc:
+            self._failed(exc, len(batch))
+            return
+        self.written += len(batch)
+        inc("healthmate_audit_records_total", len(batch), help="Audit records by outcome.", result="written")
+
+    def _sync(self) -> None:
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError as exc:
+            self._failed(exc, 0)
+
+    def _rotate(self) -> None:
+        # audit.jsonl -> audit.jsonl.1 -> ... -> audit.jsonl.<backup_count> (then deleted)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, "ab")
+        self._size = 0
+
+    def _failed(self, exc: OSError, n: int) -> None:
+        # The writer keeps running (the disk may come back); each new error is reported once
+        self.dropped += n
+        if n:
+            inc("healthmate_audit_records_total", n, help="Audit records by outcome.", result="dropped")
+        if str(exc) != self.last_error:
+            print(f"⚠️ Audit log write failed ({self.path}): {exc}", file=sys.stderr)
+        self.last_error = str(exc)
+        if self._file.closed:
+            try:
+                self._file = open(self.path, "ab")
+                self._size = self._file.tell()
+            except OSError:
+                pass
+
+
+def audit_files(directory: str = AUDIT_DIR) -> List[str]:
+    # Oldest first, so reading them in order replays the audit trail
+    path = os.path.join(directory, AUDIT_FILE)
+    rotated = [p for p in glob.glob(path + ".*") if p.rsplit(".", 1)[-1].isdigit()]
+    rotated.sort(key=lambda p: int(p.rsplit(".", 1)[-1]), reverse=True)
+    return rotated + ([path] if os.path.exists(path) else [])
+
+
+_sink: Optional[AuditSink] = None
+_sink_lock = threading.RLock()
+
+
+def use_audit_dir(directory: str, **kwargs: Any) -> Optional[AuditSink]:
+    # Point the process at a different audit directory (e.g. server.py --audit-dir)
+    global _sink
+    if not ENABLED:
+        return None
+    sink = AuditSink(directory, **kwargs)
+    with _sink_lock:
+        old, _sink = _sink, sink
+    if old is not None:
+        old.close()
+    add_collector("audit", lambda: [("healthmate_audit_queue_depth", "gauge", {}, sink.depth)])
+    return sink
+
+
+def get_sink() -> Optional[AuditSink]:
+    # Shared by every request (and app session) in the process; None when auditing is off
+    sink = _sink
+    if sink is None and ENABLED:
+        with _sink_lock:
+            sink = _sink or use_audit_dir(AUDIT_DIR)
+    return sink
+
+
+def record(source: str, result, **fields: Any) -> None:
+    # Fire-and-forget: see audit_record() for the fields
+    sink = get_sink()
+    if sink is not None:
+        sink.record(audit_record(source, result, **fields))
@@ -0,0 +1,193 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from dataset import load_matrix
+from inference import MODEL_PATH, load_engine, symptoms_to_features
+from triage_engine import detect_flags, risk_score, triage, triage_batch
+from triage_rules import current_rules
+
+TEST_PATH = os.path.join("data", "Testing.csv")
+BASELINE_PATH = "bench_baseline.json"
+
+# Padding used to build long community-health-worker style notes
+FILLER = [
+    "patient seen at home", "mother reports", "since yesterday evening", "no known allergies",
+    "took paracetamol", "lives far from the health centre", "walked two hours", "not eating well",
+    "child is playful", "slept badly", "neighbour also sick", "no travel history",
+]
+
+
+# -----------------------------
+# Inputs
+# -----------------------------
+def testing_cases() -> List[str]:
+    ds = load_matrix(TEST_PATH)
+    cols = ds.feature_columns
+    return [", ".join(cols[j].replace("_", " ") for j in np.flatnonzero(row)) for row in ds.X]
+
+
+def synthetic_cases(n: int = 200, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    phrases = [w for words in current_rules().keywords.values() for w in words]
+    texts = []
+    for i in range(n):
+        # Mix of short messages and multi-kilobyte notes
+        n_parts = rng.choice([3, 10, 40, 200])
+        parts = [rng.choice(phrases) if rng.random() < 0.3 else rng.choice(FILLER) for _ in range(n_parts)]
+        texts.append(". ".join(parts))
+    return texts
+
+
+def random_answers(rng: random.Random) -> Dict[str, bool]:
+    return {k: rng.random() < 0.1 for k in current_rules().answer_keys}
+
+
+# -----------------------------
+# Measurement
+# -----------------------------
+def measure(fn: Callable[[Any], Any], inputs: List[Any], repeat: int) -> Dict[str, float]:
+    for x in inputs[: min(len(inputs), 20)]:  # warm-up
+        fn(x)
+
+    lat = np.empty(len(inputs) * repeat, dtype=np.float64)
+    k = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for x in inputs:
+            t0 = time.perf_counter_ns()
+            fn(x)
+            lat[k] = time.perf_counter_ns() - t0
+            k += 1
+    elapsed = time.perf_counter() - start
+
+    # Separate pass for memory: tracemalloc slows calls down too much to time them
+    tracemalloc.start()
+    for x in inputs:
+        fn(x)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p95, p99 = np.percentile(lat, [50, 95, 99]) / 1000.0
+    return {
+        "calls": int(k),
+        "throughput_per_s": k / elapsed if elapsed else float("inf"),
+        "p50_us": float(p50),
+        "p95_us": float(p95),
+        "p99_us": float(p99),
+        "peak_mem_kb": peak / 1024.0,
+    }
+
+
+def run(model_path: str, repeat: int, n_synthetic: int, batch_size: int = 5000) -> Dict[str, Any]:
+    rng = random.Random(1)
+    texts = testing_cases() + synthetic_cases(n_synthetic)
+    cases = [
+        {"symptom_text": t, "age": rng.randint(0, 90), "sex": "Female", "pregnant": rng.random() < 0.1,
+         "answers": random_answers(rng)}
+        for t in texts
+    ]
+    scored = [(detect_flags(c["symptom_text"]), c["answers"], c["age"], c["pregnant"]) for c in cases]
+
+    stages: Dict[str, Dict[str, float]] = {}
+    stages["detect_flags"] = measure(detect_flags, texts, repeat)
+    stages["risk_score"] = measure(lambda s: risk_score(*s), scored, repeat)
+    stages["triage"] = measure(lambda c: triage(**c), cases, repeat)
+
+    # One call = a whole backlog of cases with pre-computed flags, one by one vs batched
+    batch = [dict(c, flags=s[0]) for c, s in zip(cases, scored)]
+    batch = (batch * (batch_size // len(batch) + 1))[:batch_size]
+    stages["triage_loop"] = measure(lambda b: [triage(**c) for c in b], [batch], repeat)
+    stages["triage_batch"] = measure(triage_batch, [batch], repeat)
+
+    if os.path.exists(model_path):
+        cached = load_engine(model_path)
+        engine = getattr(cached, "engine", cached)  # time the forest itself, not the cache
+        cols = engine.feature_columns
+        features = [symptoms_to_features(t, cols)[0] for t in texts]
+        stages["symptoms_to_features"] = measure(lambda t: symptoms_to_features(t, cols), texts, repeat)
+        stages["predict"] = measure(engine.predict, features, repeat)
+        stages["predict_cached"] = measure(cached.predict, features, repeat)
+    else:
+        print(f"⚠️ {model_path} not found; skipping model stages (run train_model.py first)", file=sys.stderr)
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "inputs": len(texts),
+            "repeat": repeat,
+            "batch_size": batch_size,
+        },
+        "stages": stages,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    failures = []
+    for stage, base in baseline.get("stages", {}).items():
+        cur = current["stages"].get(stage)
+        if cur is None:
+            continue
+        for key in ("p50_us", "p95_us"):
+            if cur[key] > base[key] * (1 + tolerance):
+                failures.append(f"{stage}.{key}: {cur[key]:.1f} > {base[key]:.1f} (+{tolerance:.0%})")
+        if cur["throughput_per_s"] < base["throughput_per_s"] / (1 + tolerance):
+            failures.append(f"{stage}.throughput_per_s: {cur['throughput_per_s']:.0f} < "
+                            f"{base['throughput_per_s']:.0f} (-{tolerance:.0%})")
+    return failures
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{'stage':<22}{'ops/s':>12}{'p50 µs':>10}{'p95 µs':>10}{'p99 µs':>10}{'peak KB':>10}")
+    for stage, r in result["stages"].items():
+        print(f"{stage:<22}{r['throughput_per_s']:>12.0f}{r['p50_us']:>10.1f}{r['p95_us']:>10.1f}"
+              f"{r['p99_us']:>10.1f}{r['peak_mem_kb']:>10.1f}")
+    loop, batch = result["stages"].get("triage_loop"), result["stages"].get("triage_batch")
+    if loop and batch:
+        print(f"triage_batch: {batch['p50_us'] / 1000:.1f} ms vs {loop['p50_us'] / 1000:.1f} ms one by one for "
+              f"{result['meta']['batch_size']} cases ({loop['p50_us'] / batch['p50_us']:.1f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the HealthMate triage and prediction hot paths")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--synthetic", type=int, default=200, help="number of synthetic free-text cases")
+    parser.add_argument("--batch", type=int, default=5000, help="cases per triage_loop / triage_batch call")
+    parser.add_argument("--save", metavar="PATH", help="write results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", nargs="?", const=BASELINE_PATH,
+                        help=f"fail if slower than a saved baseline (default {BASELINE_PATH})")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed regression, e.g. 0.25 = 25%%")
+    args = parser.parse_args()
+
+    result = run(args.model, args.repeat, args.synthetic, args.batch)
+    print_report(result)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Baseline saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = compare(result, baseline, args.tolerance)
+        if failures:
+            print("❌ Performance regression:")
+            for line in failures:
+                print("  " + line)
+            sys.exit(1)
+        print(f"✅ No stage regressed more than {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
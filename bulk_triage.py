@@ -0,0 +1,228 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Deque, Dict, Iterator, List, Optional, TextIO, Tuple
+
+import numpy as np
+
+import audit
+from facilities import check_location
+from inference import DIFFERENTIAL_SIZE, MODEL_PATH, load_engine, symptoms_to_features
+from sms_codec import encode_result
+from triage_engine import triage_batch
+from triage_rules import current_rules
+
+TRUE_VALUES = {"1", "true", "t", "yes", "y"}
+
+# Loaded once per worker process by the pool initializer
+_engine = None
+
+
+# -----------------------------
+# Input parsing (streaming)
+# -----------------------------
+def _as_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def normalize_case(raw: Dict[str, Any], answer_keys: Optional[List[str]] = None) -> Dict[str, Any]:
+    answers = raw.get("answers") or {}
+    if isinstance(answers, str):  # CSV column holding a JSON object
+        answers = json.loads(answers) if answers.strip() else {}
+    if not isinstance(answers, dict):
+        raise ValueError("answers must be an object of question -> yes/no")
+    answers = {k: _as_bool(v) for k, v in answers.items()}
+    # CSV files may also carry one column per follow-up answer
+    for key in answer_keys if answer_keys is not None else current_rules().answer_keys:
+        if key in raw and key not in answers:
+            answers[key] = _as_bool(raw[key])
+
+    location = None
+    if raw.get("lat") not in (None, "") and raw.get("lon") not in (None, ""):
+        location = (float(raw["lat"]), float(raw["lon"]))
+        check_location(*location)
+
+    age = raw.get("age")
+    return {
+        "id": raw.get("id"),
+        "symptom_text": str(raw.get("symptom_text") or raw.get("symptoms") or ""),
+        "age": int(float(age)) if age not in (None, "") else 28,
+        "sex": str(raw.get("sex") or ""),
+        "pregnant": _as_bool(raw.get("pregnant")),
+        "answers": answers,
+        "language": raw.get("language") or None,
+        "location": location,
+    }
+
+
+def read_cases(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Any]]:
+    # Yields (line number, raw case or parse error) without reading the whole file
+    if fmt == "csv":
+        for i, row in enumerate(csv.DictReader(stream), start=2):
+            yield i, row
+    else:
+        for i, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield i, json.loads(line)
+            except ValueError as exc:
+                yield i, exc
+
+
+# -----------------------------
+# Worker side
+# -----------------------------
+def _init_worker(model_path: Optional[str]) -> None:
+    global _engine
+    _engine = load_engine(model_path, cache_size=0) if model_path else None
+
+
+def process_chunk(chunk: List[Tuple[int, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    # -> (output rows in input order, audit records). Workers only build the audit
+    # records; the parent process is the single writer of the audit log.
+    out: List[Optional[Dict[str, Any]]] = [None] * len(chunk)
+    records: List[Dict[str, Any]] = []
+    rules = current_rules()  # one version for the whole chunk
+    cases, slots, feature_rows = [], [], []
+    for pos, (line, raw) in enumerate(chunk):
+        try:
+            if isinstance(raw, Exception):
+                raise raw
+            if not isinstance(raw, dict):
+                raise ValueError("case must be an object")
+            case = normalize_case(raw, rules.answer_keys)
+            columns = _engine.feature_columns if _engine is not None else ()
+            features, flags = symptoms_to_features(case["symptom_text"], columns, case["language"], rules)
+        except (ValueError, TypeError) as exc:
+            out[pos] = {"line": line, "error": str(exc)}
+            continue
+        case["flags"] = flags
+        cases.append(case)
+        slots.append((pos, line))
+        feature_rows.append(features)
+
+    if cases:
+        ranked = [[] for _ in cases]
+        if _engine is not None:
+            X = np.zeros((len(cases), len(_engine.feature_columns)), dtype=np.float64)
+            for i, features in enumerate(feature_rows):
+                X[i, features] = 1.0
+            # One vectorised pass: top-k labels + calibrated probabilities for the whole chunk
+            labels, probs = _engine.top_k_batch(X, DIFFERENTIAL_SIZE)
+            for case, lrow, prow in zip(cases, labels, probs):
+                case["confidence"] = float(prow[0])
+            ranked = [[{"prognosis": str(c), "probability": round(float(p), 4)} for c, p in zip(lrow, prow)]
+                      for lrow, prow in zip(labels, probs)]
+
+        for (pos, line), case, diff, res in zip(slots, cases, ranked, triage_batch(cases, rules)):
+            out[pos] = {
+                "line": line,
+                "id": case["id"],
+                "prediction": diff[0]["prognosis"] if diff else None,
+                "differential": diff,
+                "level": res.level,
+                "title": res.title,
+                "reasons": list(res.reasons),
+                "rule_version": res.rule_version,
+                "facilities": list(res.suggested_facilities) if res.referrals else [],
+                "code": encode_result(res),
+            }
+            if audit.ENABLED:
+                records.append(audit.audit_record(
+                    "bulk", res, symptom_text=case["symptom_text"], age=case["age"], sex=case["sex"],
+                    pregnant=case["pregnant"], answers=case["answers"], flags=case["flags"],
+                    prediction=diff[0]["prognosis"] if diff else None, language=case["language"],
+                    location=case["location"], differential=[[d["prognosis"], d["probability"]] for d in diff],
+                    line=line, id=case["id"],
+                ))
+    return out, records
+
+
+# -----------------------------
+# Ordered streaming driver
+# -----------------------------
+def run(cases: Iterator[Tuple[int, Any]], out: TextIO, model_path: Optional[str], workers: int,
+        chunk_size: int) -> int:
+    chunks = iter(lambda: list(islice(cases, chunk_size)), [])
+    written = 0
+    sink = audit.get_sink()
+
+    def emit(chunk_out: Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]) -> None:
+        nonlocal written
+        results, records = chunk_out
+        for r in results:
+            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+        written += len(results)
+        if sink is not None:
+            for record in records:
+                sink.record(record, block=True)  # wait for the writer rather than lose audit records
+
+    if workers <= 0:
+        _init_worker(model_path)
+        for chunk in chunks:
+            emit(process_chunk(chunk))
+        return written
+
+    # At most 2 chunks per worker are in flight, so memory stays flat however big
+    # the input is; results are written strictly in submission (= input) order.
+    max_inflight = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_path,)) as pool:
+        pending: Deque[Future] = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(process_chunk, chunk))
+            if len(pending) >= max_inflight:
+                emit(pending.popleft().result())
+        while pending:
+            emit(pending.popleft().result())
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk retrospective triage of logged encounters (CSV/JSONL -> JSONL)")
+    parser.add_argument("--language", help="default language code for cases without a 'language' field")
+    parser.add_argument("input", help="CSV or JSONL file of cases, or - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="JSONL output file (default: stdout)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="input format (default: from file extension)")
+    parser.add_argument("--model", default=MODEL_PATH, help="model artifact; pass '' to skip prediction")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes (0 = run in-process)")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--audit-dir", default=audit.AUDIT_DIR, help="rotating audit log directory")
+    args = parser.parse_args()
+
+    fmt = args.format or ("csv" if args.input.lower().endswith(".csv") else "jsonl")
+    model_path = args.model or None
+    if model_path and not os.path.exists(model_path):
+        parser.error(f"{model_path} not found (run train_model.py first, or pass --model '')")
+
+    src = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="") if args.input == "-" \
+        else open(args.input, encoding="utf-8", newline="")
+    dst = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    sink = audit.use_audit_dir(args.audit_dir)
+    try:
+        cases = read_cases(src, fmt)
+        if args.language:
+            cases = (
+                (i, {**raw, "language": raw.get("language") or args.language} if isinstance(raw, dict) else raw)
+                for i, raw in cases
+            )
+        n = run(cases, dst, model_path, args.workers, args.chunk_size)
+    finally:
+        src.close()
+        if dst is not sys.stdout:
+            dst.close()
+        if sink is not None:
+            sink.close()  # write out queued audit records
+    print(f"✅ Triaged {n} cases", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CASE_LOG_PATH = os.path.join("data", "case_log.jsonl")
+
+
+# Append-only log of clinician-confirmed cases, one JSON object per line:
+#   {"ts": "...", "symptoms": ["chills", "high_fever"], "diagnosis": "Malaria"}
+# Symptoms are stored by column name, so the log stays valid if the dataset's
+# column order changes. Retraining reads it from a byte offset checkpoint.
+def append_case(symptoms: Iterable[str], diagnosis: str, path: str = CASE_LOG_PATH, **extra: Any) -> None:
+    diagnosis = str(diagnosis).strip()
+    if not diagnosis:
+        raise ValueError("diagnosis is required")
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "symptoms": sorted({str(s).strip() for s in symptoms if str(s).strip()}),
+        "diagnosis": diagnosis,
+        **extra,
+    }
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # One O_APPEND write per record, so concurrent writers never interleave lines
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_since(path: str = CASE_LOG_PATH, offset: int = 0,
+               until: Optional[int] = None) -> Tuple[List[Dict[str, Any]], int]:
+    # -> (records after `offset` [and before `until`], offset to checkpoint). A trailing
+    # line without a newline is still being written and is left for the next run.
+    if not os.path.exists(path):
+        if offset:
+            raise ValueError(f"{path} is missing but the model has consumed {offset} bytes of it")
+        return [], 0
+    actual = os.path.getsize(path)
+    checkpoint = max(offset, until or 0)
+    if actual < checkpoint:
+        raise ValueError(f"{path} is shorter than the checkpoint ({actual} < {checkpoint} bytes); "
+                         f"it was truncated or replaced, so retrain from scratch")
+    size = actual if until is None else until
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(size - offset)
+    end = data.rfind(b"\n") + 1
+    records, skipped = [], 0
+    for raw in data[:end].splitlines():
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw.decode("utf-8"))
+            if not isinstance(record, dict) or not record.get("diagnosis"):
+                raise ValueError
+        except ValueError:
+            skipped += 1
+            continue
+        records.append(record)
+    if skipped:
+        print(f"⚠️ Skipped {skipped} malformed line(s) in {path}", file=sys.stderr)
+    return records, offset + end
+
+
+def records_to_matrix(records: Sequence[Dict[str, Any]], feature_columns: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    col = {c.strip(): j for j, c in enumerate(feature_columns)}
+    X = np.zeros((len(records), len(feature_columns)), dtype=np.uint8)
+    unknown = set()
+    for i, record in enumerate(records):
+        for s in record.get("symptoms") or ():
+            j = col.get(str(s).strip())
+            if j is None:
+                unknown.add(s)
+            else:
+                X[i, j] = 1
+    if unknown:
+        print(f"⚠️ Ignored symptoms not in the model's columns: {sorted(unknown)[:10]}", file=sys.stderr)
+    y = np.array([str(r["diagnosis"]).strip() for r in records], dtype=object)
+    return X, y
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record a clinician-confirmed case for retraining")
+    parser.add_argument("diagnosis")
+    parser.add_argument("symptoms", nargs="+", help="symptom column names, e.g. high_fever chills")
+    parser.add_argument("--log", default=CASE_LOG_PATH)
+    args = parser.parse_args()
+    append_case(args.symptoms, args.diagnosis, args.log)
+    print(f"✅ Appended to {args.log}")
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import sys
+from typing import List, NamedTuple
+
+import numpy as np
+
+CACHE_DIR = os.path.join("data", "cache")
+TARGET_COL = "prognosis"
+CHUNK_ROWS = 50_000
+
+
+# Compact, memory-mappable copy of a symptom CSV:
+#   X: (n_rows, n_features) uint8 — one byte per binary symptom instead of int64
+#   y: (n_rows,) uint16 codes into `classes`
+class Dataset(NamedTuple):
+    X: np.ndarray
+    y: np.ndarray
+    classes: np.ndarray
+    feature_columns: List[str]
+
+    def labels(self) -> np.ndarray:
+        return self.classes[self.y]
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cache_paths(csv_path: str, cache_dir: str):
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    base = os.path.join(cache_dir, stem)
+    return base + ".X.npy", base + ".y.npy", base + ".meta.json"
+
+
+def build_cache(csv_path: str, cache_dir: str = CACHE_DIR, target_col: str = TARGET_COL) -> None:
+    import pandas as pd
+
+    os.makedirs(cache_dir, exist_ok=True)
+    x_path, y_path, meta_path = _cache_paths(csv_path, cache_dir)
+    digest = file_sha256(csv_path)
+
+    header = pd.read_csv(csv_path, nrows=0).columns
+    # Many versions of this dataset include an extra unnamed column at the end
+    columns = [c for c in header if not str(c).startswith("Unnamed")]
+    if target_col not in columns:
+        raise ValueError(f"Expected target column '{target_col}' not found. Columns: {columns[:10]}...")
+    feature_columns = [c for c in columns if c != target_col]
+
+    # Stream the CSV in chunks straight into uint8 so the int64 frame never exists
+    raw_path = x_path + ".raw.tmp"
+    class_ids = {}
+    codes = []
+    n_rows = 0
+    reader = pd.read_csv(
+        csv_path,
+        usecols=columns,
+        dtype={c: np.uint8 for c in feature_columns},
+        chunksize=CHUNK_ROWS,
+    )
+    with open(raw_path, "wb") as raw:
+        for chunk in reader:
+            raw.write(np.ascontiguousarray(chunk[feature_columns].to_numpy(dtype=np.uint8)).tobytes())
+            for label in chunk[target_col].astype(str):
+                codes.append(class_ids.setdefault(label, len(class_ids)))
+            n_rows += len(chunk)
+
+    # Sorted classes match what sklearn estimators report in classes_
+    classes = sorted(class_ids)
+    remap = np.empty(len(classes), dtype=np.uint16)
+    for new, name in enumerate(classes):
+        remap[class_ids[name]] = new
+
+    x_tmp, y_tmp, meta_tmp = x_path + ".tmp", y_path + ".tmp", meta_path + ".tmp"
+    X = np.lib.format.open_memmap(x_tmp, mode="w+", dtype=np.uint8, shape=(n_rows, len(feature_columns)))
+    if n_rows:
+        src = np.memmap(raw_path, dtype=np.uint8, mode="r", shape=(n_rows, len(feature_columns)))
+        for start in range(0, n_rows, CHUNK_ROWS):
+            X[start:start + CHUNK_ROWS] = src[start:start + CHUNK_ROWS]
+        del src
+    X.flush()
+    del X
+    os.remove(raw_path)
+
+    with open(y_tmp, "wb") as f:
+        np.save(f, remap[np.asarray(codes, dtype=np.int64)] if codes else np.empty(0, dtype=np.uint16))
+    with open(meta_tmp, "w", encoding="utf-8") as f:
+        json.dump({
+            "source": os.path.basename(csv_path),
+            "sha256": digest,
+            "rows": n_rows,
+            "feature_columns": feature_columns,
+            "classes": classes,
+        }, f)
+
+    # Metadata goes last: a cache is only valid once its hash is recorded
+    os.replace(x_tmp, x_path)
+    os.replace(y_tmp, y_path)
+    os.replace(meta_tmp, meta_path)
+
+
+def _cache_valid(csv_path: str, cache_dir: str) -> bool:
+    x_path, y_path, meta_path = _cache_paths(csv_path, cache_dir)
+    if not all(os.path.exists(p) for p in (x_path, y_path, meta_path)):
+        return False
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get("sha256") == file_sha256(csv_path)
+
+
+def load_matrix(csv_path: str, cache_dir: str = CACHE_DIR, target_col: str = TARGET_COL) -> Dataset:
+    # Rebuilt only when the CSV's hash changes; otherwise memory-mapped zero-copy
+    if not _cache_valid(csv_path, cache_dir):
+        build_cache(csv_path, cache_dir, target_col)
+
+    x_path, y_path, meta_path = _cache_paths(csv_path, cache_dir)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    return Dataset(
+        X=np.load(x_path, mmap_mode="r"),
+        y=np.load(y_path, mmap_mode="r"),
+        classes=np.asarray(meta["classes"], dtype=object),
+        feature_columns=list(meta["feature_columns"]),
+    )
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:] or [os.path.join("data", "Training.csv"), os.path.join("data", "Testing.csv")]:
+        ds = load_matrix(path)
+        print(f"✅ {path}: {ds.X.shape[0]} rows × {ds.X.shape[1]} features, {len(ds.classes)} classes "
+              f"({ds.X.nbytes / 1024:.0f} KB as uint8)")
@@ -0,0 +1,145 @@
+import argparse
+import csv
+import os
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import timed
+
+# Override with HEALTHMATE_FACILITIES=/path/to/facilities.csv (e.g. a registry export)
+FACILITIES_PATH = os.environ.get(
+    "HEALTHMATE_FACILITIES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "facilities.csv"),
+)
+EARTH_RADIUS_KM = 6371.0
+REFERRAL_COUNT = 3
+
+# Lowest to highest level of care
+FACILITY_LEVELS = (
+    "HC II",
+    "HC III",
+    "HC IV",
+    "General Hospital",
+    "Regional Referral Hospital",
+    "National Referral Hospital",
+)
+
+# Lowest facility level that can handle each triage level
+MIN_LEVEL = {
+    "SELF_CARE": "HC II",
+    "CLINIC": "HC III",
+    "URGENT": "HC IV",
+}
+
+
+class Facility(NamedTuple):
+    row: int                    # position in the facility file (stable ID for short codes)
+    name: str
+    level: str
+    district: str
+    lat: float
+    lon: float
+    services: Tuple[str, ...]
+
+
+def read_facilities(path: str) -> List[Facility]:
+    out = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                level = row["level"].strip()
+                if level not in FACILITY_LEVELS:
+                    raise ValueError(f"unknown level '{level}'")
+                out.append(Facility(
+                    row=len(out),
+                    name=row["name"].strip(),
+                    level=level,
+                    district=(row.get("district") or "").strip(),
+                    lat=float(row["lat"]),
+                    lon=float(row["lon"]),
+                    services=tuple(s.strip() for s in (row.get("services") or "").split(";") if s.strip()),
+                ))
+            except (KeyError, TypeError, ValueError) as exc:
+                raise ValueError(f"{path}, line {line}: {exc}") from None
+    return out
+
+
+def check_location(lat: float, lon: float) -> None:
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise ValueError(f"location ({lat}, {lon}) is not a valid latitude/longitude")
+
+
+# One haversine BallTree per triage level, each holding only the facilities
+# that can handle that level, so a lookup is a single k-nearest query with no
+# filtering afterwards (unless a specific service is requested).
+class FacilityIndex:
+    def __init__(self, facilities: Sequence[Facility]):
+        from sklearn.neighbors import BallTree
+
+        self.facilities = list(facilities)
+        coords = np.radians(np.array([[f.lat, f.lon] for f in self.facilities], dtype=np.float64).reshape(-1, 2))
+        rank = np.array([FACILITY_LEVELS.index(f.level) for f in self.facilities], dtype=np.int64)
+        self._tiers = {}
+        for triage_level, min_level in MIN_LEVEL.items():
+            idx = np.flatnonzero(rank >= FACILITY_LEVELS.index(min_level))
+            tree = BallTree(coords[idx], metric="haversine") if len(idx) else None
+            self._tiers[triage_level] = (tree, idx)
+
+    def nearest_batch(self, points: np.ndarray, triage_level: str, k: int = REFERRAL_COUNT,
+                      service: Optional[str] = None) -> List[List[Tuple[Facility, float]]]:
+        # points: (n, 2) degrees [lat, lon] -> per point [(facility, distance km), ...] nearest first
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        tree, idx = self._tiers[triage_level]
+        if tree is None or not len(points) or k <= 0:
+            return [[] for _ in range(len(points))]
+
+        # With a service filter, over-fetch and widen to the whole tier if that is not enough
+        n_query = min(len(idx), k if service is None else k * 8)
+        while True:
+            dist, pos = tree.query(np.radians(points), k=n_query)
+            out = []
+            for drow, prow in zip(dist, pos):
+                found = []
+                for d, p in zip(drow, prow):
+                    f = self.facilities[idx[p]]
+                    if service is None or service in f.services:
+                        found.append((f, float(d) * EARTH_RADIUS_KM))
+                        if len(found) == k:
+                            break
+                out.append(found)
+            if n_query == len(idx) or all(len(found) == k for found in out):
+                return out
+            n_query = len(idx)
+
+    def nearest(self, lat: float, lon: float, triage_level: str, k: int = REFERRAL_COUNT,
+                service: Optional[str] = None) -> List[Tuple[Facility, float]]:
+        check_location(lat, lon)
+        with timed("referral"):
+            return self.nearest_batch(np.array([[lat, lon]]), triage_level, k, service)[0]
+
+
+# Built once per process on first use and shared by every request
+@lru_cache(maxsize=4)
+def load_facilities(path: str = FACILITIES_PATH) -> FacilityIndex:
+    return FacilityIndex(read_facilities(path))
+
+
+def format_referral(facility: Facility, distance_km: float) -> str:
+    return f"{facility.name} ({facility.level}, {distance_km:.1f} km)"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nearest facilities for a location and triage level")
+    parser.add_argument("lat", type=float)
+    parser.add_argument("lon", type=float)
+    parser.add_argument("--level", choices=sorted(MIN_LEVEL), default="CLINIC")
+    parser.add_argument("-k", type=int, default=REFERRAL_COUNT)
+    parser.add_argument("--service", help="only facilities offering this service (e.g. maternity)")
+    parser.add_argument("--facilities", default=FACILITIES_PATH)
+    args = parser.parse_args()
+
+    index = load_facilities(args.facilities)
+    for f, km in index.nearest(args.lat, args.lon, args.level, args.k, args.service):
+        print(f"{km:7.1f} km  {f.name}  [{f.level}, {f.district}]  {', '.join(f.services)}")
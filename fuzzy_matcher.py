@@ -0,0 +1,199 @@
+import os
+import re
+import time
+from collections import defaultdict
+from functools import lru_cache
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Defaults for typo-tolerant matching
+FUZZY_MAX_EDITS = 2         # upper bound; words shorter than 10 letters get 1
+FUZZY_MIN_LENGTH = 6        # shorter words ("hot", "sob", "faint") are exact-only
+FUZZY_BUDGET_MS = 5.0       # per-request cap on time spent correcting words
+
+WORD_RE = re.compile(r"[a-z']+")
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+# Bundled English frequency list (data/lexicon/english_words.txt)
+DICTIONARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lexicon", "english_words.txt")
+
+# Real words within reach of a symptom word that the frequency list is missing
+# ("bleeping" ~ bleeding, "slurped" ~ slurred)
+COMMON_WORDS = frozenset("aridity avidity bleeping digression severs slurped unwearable".split())
+
+
+def _trigrams(word: str) -> List[str]:
+    padded = f"^{word}$"
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def bounded_levenshtein(a: str, b: str, k: int) -> int:
+    # Edit distance if it is <= k, otherwise k + 1 (stops as soon as every cell exceeds k)
+    if abs(len(a) - len(b)) > k:
+        return k + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb))
+            if cur[j] < row_min:
+                row_min = cur[j]
+        if row_min > k:
+            return k + 1
+        prev = cur
+    return prev[-1] if prev[-1] <= k else k + 1
+
+
+def _edits1(word: str) -> Iterator[str]:
+    # Every string one deletion, substitution or insertion away from word
+    for i in range(len(word) + 1):
+        head, tail = word[:i], word[i:]
+        if tail:
+            yield head + tail[1:]
+            for c in ALPHABET:
+                yield head + c + tail[1:]
+        for c in ALPHABET:
+            yield head + c + tail
+
+
+# Set of real words. rival() answers "is some other real word at least as close
+# to this typo?" through the 1-edit neighbourhood, or, for the 2-edit
+# corrections of long words, through a trigram index of the 8+ letter words,
+# built per first letter on first use.
+class WordList:
+    def __init__(self, words: Iterable[str]):
+        self.words = frozenset(w.lower() for w in words)
+        self._long_index: Dict[str, Tuple[List[str], Dict[str, List[int]]]] = {}
+
+    def __contains__(self, word: str) -> bool:
+        return word in self.words
+
+    def _index(self, letter: str) -> Tuple[List[str], Dict[str, List[int]]]:
+        entry = self._long_index.get(letter)
+        if entry is None:
+            words = sorted(w for w in self.words if len(w) >= 8 and w[0] == letter)
+            index: Dict[str, List[int]] = defaultdict(list)
+            for i, w in enumerate(words):
+                for g in set(_trigrams(w)):
+                    index[g].append(i)
+            entry = self._long_index[letter] = (words, dict(index))
+        return entry
+
+    def rival(self, word: str, edits: int, exclude: Container[str] = ()) -> bool:
+        # True if a word with the same first letter, not in exclude, lies within edits of word
+        if edits <= 1:
+            return any(v in self.words and v[0] == word[0] and v not in exclude for v in _edits1(word))
+        words, index = self._index(word[0])
+        counts: Dict[int, int] = defaultdict(int)
+        for g in set(_trigrams(word)):
+            for i in index.get(g, ()):
+                counts[i] += 1
+        for i, shared in counts.items():
+            cand = words[i]
+            if abs(len(cand) - len(word)) > edits or shared < max(len(cand), len(word)) - 3 * edits:
+                continue
+            if cand not in exclude and bounded_levenshtein(word, cand, edits) <= edits:
+                return True
+        return False
+
+
+@lru_cache(maxsize=None)
+def english_words() -> WordList:
+    with open(DICTIONARY_PATH, encoding="utf-8") as f:
+        return WordList(line.strip() for line in f if line.strip() and not line.startswith("#"))
+
+
+# Corrects misspelled words towards the vocabulary of the matcher's phrases.
+# Candidates come from a character-trigram inverted index (q-gram count filter),
+# so each word is compared against a handful of vocabulary words rather than
+# all of them, and corrections are memoised per distinct word. A correction
+# keeps the typed first letter (typos rarely hit it, while "lightness" ->
+# tightness or "pitching" -> itching would turn ordinary words into symptoms).
+# Real words ("connection", "paused") are never corrected, and a typo is only
+# corrected when the symptom word is strictly closer than any real word with
+# the same first letter ("confussion" is as near confession as confusion).
+class FuzzyCorrector:
+    def __init__(self, vocabulary: Iterable[str], max_edits: int = FUZZY_MAX_EDITS,
+                 min_length: int = FUZZY_MIN_LENGTH, memo_size: int = 65536,
+                 dictionary: Optional[WordList] = None, common_words: Iterable[str] = COMMON_WORDS):
+        self.max_edits = max_edits
+        self.min_length = min_length
+        vocabulary = set(vocabulary)
+        self.words = sorted(w for w in vocabulary if len(w) >= min_length)
+        self._vocabulary = vocabulary
+        self._dictionary = dictionary if dictionary is not None else english_words()
+        self._known = vocabulary | set(common_words)
+        self._index: Dict[str, List[int]] = defaultdict(list)
+        for i, w in enumerate(self.words):
+            for g in set(_trigrams(w)):
+                self._index[g].append(i)
+        self._memo: Dict[str, Optional[str]] = {}
+        self._memo_size = memo_size
+        # Only words long enough to be corrected are visited at all
+        self._candidate_re = re.compile(r"[a-z']{%d,}" % min_length)
+
+    def allowed_edits(self, word: str) -> int:
+        return min(self.max_edits, 1 if len(word) < 10 else 2)
+
+    def correct_word(self, word: str) -> Optional[str]:
+        if word in self._known or len(word) < self.min_length or word in self._dictionary:
+            return None
+        if word in self._memo:
+            return self._memo[word]
+
+        k = self.allowed_edits(word)
+        grams = set(_trigrams(word))
+        counts: Dict[int, int] = defaultdict(int)
+        for g in grams:
+            for i in self._index.get(g, ()):
+                counts[i] += 1
+
+        best, best_d = None, k + 1
+        for i, shared in counts.items():
+            cand = self.words[i]
+            if cand[0] != word[0]:
+                continue
+            # q-gram lemma: k edits destroy at most 3k of a word's trigrams
+            if abs(len(cand) - len(word)) > k or shared < max(len(cand), len(word)) - 3 * k:
+                continue
+            d = bounded_levenshtein(word, cand, min(k, self.allowed_edits(cand)))
+            if d < best_d or (d == best_d and best is not None and cand < best):
+                best, best_d = cand, d
+        if best is not None and self._dictionary.rival(word, best_d, self._vocabulary):
+            best = None
+
+        if len(self._memo) >= self._memo_size:
+            self._memo.clear()
+        self._memo[word] = best
+        return best
+
+    def correct(self, text: str, budget_ms: float = FUZZY_BUDGET_MS) -> Tuple[str, List[Tuple[int, int]]]:
+        # -> (text with misspelt words replaced, (start, end) of each replacement in
+        # the new text). Words left once the budget is spent are kept as typed.
+        # Each distinct word is looked up once; text without typos is returned as is.
+        deadline = time.perf_counter() + budget_ms / 1000.0
+        fixes: Dict[str, str] = {}
+        for word in dict.fromkeys(self._candidate_re.findall(text)):
+            if time.perf_counter() > deadline:
+                break
+            fixed = self.correct_word(word)
+            if fixed is not None:
+                fixes[word] = fixed
+        if not fixes:
+            return text, []
+
+        spans: List[Tuple[int, int]] = []
+        shift = 0
+
+        def repl(m: "re.Match") -> str:
+            nonlocal shift
+            word = m.group(0)
+            fixed = fixes.get(word)
+            if fixed is None:
+                return word
+            start = m.start() + shift
+            spans.append((start, start + len(fixed)))
+            shift += len(fixed) - len(word)
+            return fixed
+
+        return self._candidate_re.sub(repl, text), spans
@@ -0,0 +1,812 @@
+import json
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from dataset import CACHE_DIR, file_sha256
+from metrics import add_collector, timed
+from triage_engine import get_matcher
+from triage_rules import RuleSet, current_rules
+
+MODEL_PATH = "model.joblib"
+PREDICTION_CACHE_SIZE = 4096
+# HEALTHMATE_WARMUP=0 skips loading the model in the background at startup
+WARMUP = os.environ.get("HEALTHMATE_WARMUP", "1") != "0"
+
+# A feature set is either a list of active column indices or a packed int bitmask
+Features = Union[int, Sequence[int]]
+
+
+# -----------------------------
+# Symptom text -> model features
+# -----------------------------
+def symptoms_to_features(symptom_text: str, feature_columns, language: Optional[str] = None,
+                         rules: Optional[RuleSet] = None) -> Tuple[List[int], Dict[str, bool]]:
+    # One pass over the text yields both the model features and the triage flags
+    with timed("symptoms_to_features"):
+        flags, hits = get_matcher(tuple(feature_columns), language, rules).scan(symptom_text)
+    return hits, flags
+
+
+def pack_features(indices: Iterable[int]) -> int:
+    mask = 0
+    for i in indices:
+        mask |= 1 << int(i)
+    return mask
+
+
+def unpack_features(mask: int) -> List[int]:
+    out = []
+    i = 0
+    while mask:
+        if mask & 1:
+            out.append(i)
+        mask >>= 1
+        i += 1
+    return out
+
+
+def features_to_row(features: Features, n_features: int) -> np.ndarray:
+    if isinstance(features, (int, np.integer)):
+        features = unpack_features(int(features))
+    row = np.zeros(n_features, dtype=np.float64)
+    row[list(features)] = 1.0
+    return row
+
+
+# -----------------------------
+# Ranked differential
+# -----------------------------
+# Conditions shown per case by the app, /triage and bulk_triage.py
+DIFFERENTIAL_SIZE = 3
+
+
+def calibrate(proba: np.ndarray, temperature: float = 1.0) -> np.ndarray:
+    # Temperature scaling (T fitted by train_model.py on held-out cases): p ** (1/T),
+    # renormalised. T < 1 sharpens, T > 1 flattens; the ranking never changes.
+    if temperature == 1.0:
+        return proba
+    logp = np.log(np.maximum(proba, 1e-12)) / temperature
+    logp -= logp.max(axis=-1, keepdims=True)
+    p = np.exp(logp)
+    return p / p.sum(axis=-1, keepdims=True)
+
+
+def rank_top_k(engine, proba: np.ndarray, k: int = DIFFERENTIAL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    # proba: (n, n_classes) from a single predict_proba(_batch) pass ->
+    # (labels (n, k), calibrated probabilities (n, k)), most likely first.
+    # Ties keep class order, so the first label is always what predict() returns.
+    proba = np.atleast_2d(proba)
+    k = max(1, min(int(k), proba.shape[1]))
+    order = np.argsort(-proba, axis=1, kind="stable")[:, :k]
+    return engine.classes_[order], np.take_along_axis(calibrate(proba, engine.temperature), order, axis=1)
+
+
+def differential(engine, proba: np.ndarray, k: int = DIFFERENTIAL_SIZE) -> List[List[Tuple[str, float]]]:
+    # -> per case [(prognosis, calibrated probability), ...]
+    labels, p = rank_top_k(engine, proba, k)
+    return [[(str(c), float(q)) for c, q in zip(lrow, prow)] for lrow, prow in zip(labels, p)]
+
+
+# -----------------------------
+# Flat-array RandomForest inference
+# -----------------------------
+# The 300 sklearn trees are exported once into contiguous arrays so a single-row
+# prediction is a few dozen vectorised gathers across all trees at once: no
+# pandas, no per-tree Python loop and no joblib thread pool.
+class ForestEngine:
+    ARRAYS = ("feature", "threshold", "children", "leaf_index", "leaf_value", "roots")
+    SCALARS = ("max_depth",)
+    temperature = 1.0   # probability calibration, set from the payload
+
+    def __init__(self, feature_columns: Sequence[str], classes: Sequence[str], feature: np.ndarray,
+                 threshold: np.ndarray, children: np.ndarray, leaf_index: np.ndarray,
+                 leaf_value: np.ndarray, roots: np.ndarray, max_depth: int):
+        self.feature_columns = list(feature_columns)
+        self.classes_ = np.asarray(classes, dtype=object)
+        self.feature = feature          # (n_nodes,) split feature; 0 for leaves
+        self.threshold = threshold      # (n_nodes,) split threshold; +inf for leaves
+        self.children = children        # (n_nodes * 2,) [left, right]; leaves point to themselves
+        self.leaf_index = leaf_index    # (n_nodes,) row into leaf_value; -1 for split nodes
+        self.leaf_value = leaf_value    # (n_leaves, n_classes) class distribution per leaf
+        self.roots = roots              # (n_trees,) root node of each tree
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_sklearn(cls, model, feature_columns: Sequence[str]) -> "ForestEngine":
+        estimators = getattr(model, "estimators_", None) or [model]
+        n_classes = len(model.classes_)
+
+        features, thresholds, children, leaf_index, leaf_values, roots = [], [], [], [], [], []
+        offset = 0
+        n_leaves = 0
+        max_depth = 0
+        for est in estimators:
+            t = est.tree_
+            n = t.node_count
+            is_leaf = t.children_left == -1
+            node_ids = np.arange(n, dtype=np.int64) + offset
+
+            left = np.where(is_leaf, node_ids, t.children_left + offset)
+            right = np.where(is_leaf, node_ids, t.children_right + offset)
+            children.append(np.stack([left, right], axis=1).ravel())
+            features.append(np.where(is_leaf, 0, t.feature))
+            thresholds.append(np.where(is_leaf, np.inf, t.threshold))
+
+            idx = np.full(n, -1, dtype=np.int64)
+            idx[is_leaf] = np.arange(is_leaf.sum()) + n_leaves
+            leaf_index.append(idx)
+
+            value = t.value[is_leaf, 0, :].astype(np.float64)
+            value /= value.sum(axis=1, keepdims=True)
+            leaf_values.append(value)
+
+            roots.append(offset)
+            offset += n
+            n_leaves += int(is_leaf.sum())
+            max_depth = max(max_depth, t.max_depth)
+
+        return cls(
+            feature_columns=feature_columns,
+            classes=model.classes_,
+            feature=np.concatenate(features).astype(np.int32),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            children=np.concatenate(children).astype(np.int64),
+            leaf_index=np.concatenate(leaf_index),
+            leaf_value=np.concatenate(leaf_values).reshape(-1, n_classes),
+            roots=np.asarray(roots, dtype=np.int64),
+            max_depth=max_depth,
+        )
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_columns)
+
+    def to_row(self, features: Features) -> np.ndarray:
+        return features_to_row(features, self.n_features)
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        # X: (n_cases, n_features) -> leaf node per (case, tree).
+        # Works on a flat (case, tree) array and drops pairs as they reach a leaf,
+        # so deep trees only cost time for the few inputs that actually go deep.
+        n, n_trees = X.shape[0], len(self.roots)
+        flat_x = np.ascontiguousarray(X).ravel()
+        node = np.tile(self.roots, n)
+        row_base = np.repeat(np.arange(n, dtype=np.int64) * X.shape[1], n_trees)
+        active = np.arange(n * n_trees)
+        feature, threshold, children, leaf_index = self.feature, self.threshold, self.children, self.leaf_index
+        for _ in range(self.max_depth):
+            nd = node[active]
+            go_right = flat_x[row_base[active] + feature[nd]] > threshold[nd]
+            nd = children[nd * 2 + go_right]
+            node[active] = nd
+            active = active[leaf_index[nd] < 0]
+            if not active.size:
+                break
+        return node.reshape(n, n_trees)
+
+    def _leaves_row(self, x: np.ndarray) -> np.ndarray:
+        # Single-row variant of _leaves on 1-D arrays (the interactive hot path)
+        node = self.roots
+        feature, threshold, children, leaf_index = self.feature, self.threshold, self.children, self.leaf_index
+        for depth in range(self.max_depth):
+            node = children[node * 2 + (x[feature[node]] > threshold[node])]
+            if depth % 8 == 7 and (leaf_index[node] >= 0).all():
+                break
+        return node
+
+    def predict_proba_batch(self, X) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64)
+        leaves = self.leaf_index[self._leaves(X)]
+        # Accumulate tree by tree (as sklearn does) instead of materialising a
+        # (cases, trees, classes) temporary
+        proba = np.zeros((X.shape[0], self.leaf_value.shape[1]), dtype=np.float64)
+        for t in range(leaves.shape[1]):
+            proba += self.leaf_value[leaves[:, t]]
+        return proba / len(self.roots)
+
+    def predict_batch(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba_batch(X).argmax(axis=1)]
+
+    def predict_proba(self, features: Features) -> np.ndarray:
+        leaves = self.leaf_index[self._leaves_row(self.to_row(features))]
+        return self.leaf_value[leaves].sum(axis=0) / len(self.roots)
+
+    def predict(self, features: Features) -> str:
+        return self.classes_[int(self.predict_proba(features).argmax())]
+
+    def top_k(self, features: Features, k: int = DIFFERENTIAL_SIZE) -> List[Tuple[str, float]]:
+        return differential(self, self.predict_proba(features)[None, :], k)[0]
+
+    def top_k_batch(self, X, k: int = DIFFERENTIAL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        return rank_top_k(self, self.predict_proba_batch(X), k)
+
+
+# Bernoulli naive Bayes as two small arrays: the joint log-likelihood of a binary
+# row is a base vector plus the per-feature deltas of its active symptoms.
+class BernoulliNBEngine:
+    ARRAYS = ("base", "delta")
+    SCALARS = ()
+    temperature = 1.0
+
+    def __init__(self, feature_columns: Sequence[str], classes: Sequence[str], base: np.ndarray, delta: np.ndarray):
+        self.feature_columns = list(feature_columns)
+        self.classes_ = np.asarray(classes, dtype=object)
+        self.base = base      # (n_classes,) class log prior + sum(log(1 - p))
+        self.delta = delta    # (n_features, n_classes) log(p) - log(1 - p)
+
+    @classmethod
+    def from_sklearn(cls, model, feature_columns: Sequence[str]) -> "BernoulliNBEngine":
+        log_p = model.feature_log_prob_                 # (n_classes, n_features)
+        log_q = np.log1p(-np.exp(log_p))
+        base = model.class_log_prior_ + log_q.sum(axis=1)
+        return cls(feature_columns, model.classes_, base, np.ascontiguousarray((log_p - log_q).T))
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_columns)
+
+    def to_row(self, features: Features) -> np.ndarray:
+        return features_to_row(features, self.n_features)
+
+    @staticmethod
+    def _softmax(jll: np.ndarray) -> np.ndarray:
+        jll = jll - jll.max(axis=-1, keepdims=True)
+        p = np.exp(jll)
+        return p / p.sum(axis=-1, keepdims=True)
+
+    def predict_proba_batch(self, X) -> np.ndarray:
+        X = (np.asarray(X, dtype=np.float64) > 0).astype(np.float64)
+        return self._softmax(self.base + X @ self.delta)
+
+    def predict_batch(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba_batch(X).argmax(axis=1)]
+
+    def predict_proba(self, features: Features) -> np.ndarray:
+        if isinstance(features, (int, np.integer)):
+            features = unpack_features(int(features))
+        return self._softmax(self.base + self.delta[list(features)].sum(axis=0))
+
+    def predict(self, features: Features) -> str:
+        return self.classes_[int(self.predict_proba(features).argmax())]
+
+    def top_k(self, features: Features, k: int = DIFFERENTIAL_SIZE) -> List[Tuple[str, float]]:
+        return differential(self, self.predict_proba(features)[None, :], k)[0]
+
+    def top_k_batch(self, X, k: int = DIFFERENTIAL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        return rank_top_k(self, self.predict_proba_batch(X), k)
+
+
+# -----------------------------
+# Bit-packed Hamming nearest-prototype classifier
+# -----------------------------
+# Training.csv has ~5k rows but only a few hundred distinct symptom patterns.
+# fit() de-duplicates them into prototypes (132 bits -> 3 uint64 words) with
+# sparse (prototype, class, count) triples; a query is one XOR + popcount
+# against every prototype.
+# Plain numpy, so a saved model is a few KB and needs no sklearn to load.
+def _popcount(words: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(words)
+    as_bytes = words.view(np.uint8).reshape(words.shape + (8,))
+    return _POPCOUNT_TABLE[as_bytes].sum(axis=-1, dtype=np.uint8)
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_rows(X) -> np.ndarray:
+    # (n, n_features) binary -> (n, ceil(n_features / 64)) little-endian uint64; bit i = feature i
+    X = np.asarray(X) > 0
+    n_words = max(1, -(-X.shape[1] // 64))
+    packed = np.packbits(X, axis=1, bitorder="little")
+    out = np.zeros((X.shape[0], n_words * 8), dtype=np.uint8)
+    out[:, :packed.shape[1]] = packed
+    return out.view("<u8")
+
+
+def _index_dtype(n: int) -> np.dtype:
+    # Smallest unsigned dtype (at least uint16) that can index n entries
+    return np.promote_types(np.uint16, np.min_scalar_type(max(n - 1, 0)))
+
+
+class HammingPrototypeClassifier:
+    def __init__(self, sharpness: float = 1.0):
+        self.sharpness = sharpness  # confidence ∝ exp(-sharpness * Hamming distance)
+
+    def get_params(self, deep: bool = True) -> Dict[str, float]:
+        return {"sharpness": self.sharpness}
+
+    def set_params(self, **params) -> "HammingPrototypeClassifier":
+        for k, v in params.items():
+            setattr(self, k, v)
+        return self
+
+    def fit(self, X, y) -> "HammingPrototypeClassifier":
+        X = np.asarray(X)
+        self.classes_ = np.empty(0, dtype=object)
+        self.n_features_in_ = X.shape[1]
+        self.prototypes_ = np.empty((0, max(1, -(-X.shape[1] // 64))), dtype="<u8")
+        self.pair_class_ = self.pair_proto_ = np.empty(0, dtype=np.uint16)
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y) -> "HammingPrototypeClassifier":
+        # Adds rows to the tables: exact, so fit(A) + partial_fit(B) == fit(A + B)
+        # up to class order (new diagnoses are appended to classes_)
+        X = np.asarray(X)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(f"expected {self.n_features_in_} features, got {X.shape[1]}")
+        labels = np.asarray(y).astype(str)
+        class_ids = {str(c): i for i, c in enumerate(self.classes_)}
+        for label in labels:
+            class_ids.setdefault(label, len(class_ids))
+        self.classes_ = np.array(list(class_ids), dtype=object)
+        y_idx = np.array([class_ids[label] for label in labels], dtype=np.int64)
+
+        n_old = len(self.prototypes_)
+        self.prototypes_, inverse = np.unique(np.vstack([self.prototypes_, pack_rows(X)]), axis=0,
+                                              return_inverse=True)
+        inverse = inverse.ravel()
+        pairs = np.concatenate([
+            np.stack([self.pair_class_.astype(np.int64), inverse[:n_old][self.pair_proto_.astype(np.int64)]], axis=1),
+            np.stack([y_idx, inverse[n_old:]], axis=1),
+        ])
+        pairs = np.unique(pairs, axis=0)
+        # sorted by class, then prototype; uint16 indices unless the tables outgrow them
+        self.pair_class_ = pairs[:, 0].astype(_index_dtype(len(self.classes_)))
+        self.pair_proto_ = pairs[:, 1].astype(_index_dtype(len(self.prototypes_)))
+        return self
+
+    def predict_proba(self, X) -> np.ndarray:
+        return PrototypeEngine.from_model(self, [str(i) for i in range(self.n_features_in_)]).predict_proba_batch(X)
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+class PrototypeEngine:
+    BLOCK_ROWS = 1024   # batch rows per XOR block (keeps the temporary at a few MB)
+    ARRAYS = ("prototypes", "pair_class", "pair_proto")
+    SCALARS = ("sharpness",)
+    temperature = 1.0
+
+    def __init__(self, feature_columns: Sequence[str], classes: Sequence[str], prototypes: np.ndarray,
+                 pair_class: np.ndarray, pair_proto: np.ndarray, sharpness: float = 1.0):
+        self.feature_columns = list(feature_columns)
+        self.classes_ = np.asarray(classes, dtype=object)
+        self.prototypes = np.ascontiguousarray(prototypes, dtype="<u8")  # (n_protos, n_words)
+        self.sharpness = float(sharpness)
+        self.pair_class, self.pair_proto = pair_class, pair_proto
+        # (class, prototype) pairs sorted by class, so a class's nearest prototype
+        # is one minimum.reduceat over the prototype distances
+        order = np.argsort(pair_class, kind="stable")
+        pair_class = np.asarray(pair_class, dtype=np.int64)[order]
+        if len(np.unique(pair_class)) != len(self.classes_):
+            raise ValueError("every class needs at least one prototype")
+        self._pair_proto = np.asarray(pair_proto, dtype=np.int64)[order]
+        self._class_start = np.searchsorted(pair_class, np.arange(len(self.classes_)))
+
+    @classmethod
+    def from_model(cls, model: HammingPrototypeClassifier, feature_columns: Sequence[str]) -> "PrototypeEngine":
+        return cls(feature_columns, model.classes_, model.prototypes_, model.pair_class_, model.pair_proto_,
+                   model.sharpness)
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_columns)
+
+    def to_row(self, features: Features) -> np.ndarray:
+        return features_to_row(features, self.n_features)
+
+    def _pack(self, features: Features) -> np.ndarray:
+        # The packed int bitmask already is the prototype bit layout, 64 bits per word
+        mask = int(features) if isinstance(features, (int, np.integer)) else pack_features(features)
+        return np.array([(mask >> (64 * w)) & 0xFFFFFFFFFFFFFFFF for w in range(self.prototypes.shape[1])],
+                        dtype="<u8")
+
+    def _class_distances(self, packed: np.ndarray) -> np.ndarray:
+        # packed: (n, n_words) -> (n, n_classes) distance to each class's nearest prototype
+        d = _popcount(packed[:, None, :] ^ self.prototypes[None, :, :]).sum(axis=2, dtype=np.int32)
+        return np.minimum.reduceat(d[:, self._pair_proto], self._class_start, axis=1)
+
+    def _proba(self, dist: np.ndarray) -> np.ndarray:
+        logits = -self.sharpness * (dist - dist.min(axis=-1, keepdims=True))
+        p = np.exp(logits)
+        return p / p.sum(axis=-1, keepdims=True)
+
+    def predict_proba_batch(self, X) -> np.ndarray:
+        packed = pack_rows(X)
+        out = np.empty((len(packed), len(self.classes_)), dtype=np.float64)
+        for start in range(0, len(packed), self.BLOCK_ROWS):
+            block = packed[start:start + self.BLOCK_ROWS]
+            out[start:start + len(block)] = self._proba(self._class_distances(block))
+        return out
+
+    def predict_batch(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba_batch(X).argmax(axis=1)]
+
+    def predict_proba(self, features: Features) -> np.ndarray:
+        return self._proba(self._class_distances(self._pack(features)[None, :]))[0]
+
+    def predict(self, features: Features) -> str:
+        return self.classes_[int(self.predict_proba(features).argmax())]
+
+    def top_k(self, features: Features, k: int = DIFFERENTIAL_SIZE) -> List[Tuple[str, float]]:
+        return differential(self, self.predict_proba(features)[None, :], k)[0]
+
+    def top_k_batch(self, X, k: int = DIFFERENTIAL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        return rank_top_k(self, self.predict_proba_batch(X), k)
+
+
+# Fallback for estimators that are not trees (e.g. BernoulliNB from model selection):
+# same interface as ForestEngine, backed by the estimator's own predict_proba.
+class SklearnEngine:
+    temperature = 1.0
+
+    def __init__(self, model, feature_columns: Sequence[str]):
+        if "n_jobs" in model.get_params():
+            model.set_params(n_jobs=1)
+        self.model = model
+        self.feature_columns = list(feature_columns)
+        self.classes_ = np.asarray(model.classes_, dtype=object)
+
+    @property
+    def n_features(self) -> int:
+        return len(self.feature_columns)
+
+    def to_row(self, features: Features) -> np.ndarray:
+        return features_to_row(features, self.n_features)
+
+    def predict_proba_batch(self, X) -> np.ndarray:
+        return self.model.predict_proba(np.asarray(X, dtype=np.float64))
+
+    def predict_batch(self, X) -> np.ndarray:
+        return self.classes_[self.predict_proba_batch(X).argmax(axis=1)]
+
+    def predict_proba(self, features: Features) -> np.ndarray:
+        return self.predict_proba_batch(self.to_row(features)[None, :])[0]
+
+    def predict(self, features: Features) -> str:
+        return self.classes_[int(self.predict_proba(features).argmax())]
+
+    def top_k(self, features: Features, k: int = DIFFERENTIAL_SIZE) -> List[Tuple[str, float]]:
+        return differential(self, self.predict_proba(features)[None, :], k)[0]
+
+    def top_k_batch(self, X, k: int = DIFFERENTIAL_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+        return rank_top_k(self, self.predict_proba_batch(X), k)
+
+
+def engine_from_payload(payload: Dict):
+    engine = _engine_for_model(payload["model"], payload["feature_columns"])
+    engine.temperature = float((payload.get("calibration") or {}).get("temperature", 1.0))
+    return engine
+
+
+def _engine_for_model(model, feature_columns: Sequence[str]):
+    estimators = getattr(model, "estimators_", None)
+    is_tree = hasattr(model, "tree_") or (
+        isinstance(estimators, list) and all(hasattr(e, "tree_") for e in estimators)
+    )
+    if is_tree:
+        return ForestEngine.from_sklearn(model, feature_columns)
+    if isinstance(model, HammingPrototypeClassifier):
+        return PrototypeEngine.from_model(model, feature_columns)
+    if type(model).__name__ == "BernoulliNB":
+        return BernoulliNBEngine.from_sklearn(model, feature_columns)
+    return SklearnEngine(model, feature_columns)
+
+
+# -----------------------------
+# Memory-mapped engine artifact
+# -----------------------------
+# Unpickling model.joblib imports scikit-learn and rebuilds every tree object
+# before the flat arrays above can even be exported (~3 s on a small host).
+# The exported arrays are instead kept as one .npy file each in a directory
+# named after the source's content hash, so a later start just maps them:
+#   data/cache/model-<sha8>.engine/{meta.json, feature.npy, threshold.npy, ...}
+# meta.json is written last, so a directory without it is ignored.
+COMPILED_KINDS = {"forest": ForestEngine, "bernoulli_nb": BernoulliNBEngine, "prototypes": PrototypeEngine}
+COMPILED_SUFFIX = ".engine"
+
+
+def compiled_path(model_path: str, digest: str, cache_dir: str = CACHE_DIR) -> str:
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{stem}-{digest[:8]}{COMPILED_SUFFIX}")
+
+
+def save_compiled(engine, directory: str, source_sha256: str = "") -> None:
+    kind = next((k for k, c in COMPILED_KINDS.items() if type(engine) is c), None)
+    if kind is None:
+        raise ValueError(f"{type(engine).__name__} has no memory-mapped form")
+    cls = COMPILED_KINDS[kind]
+    # Per process and thread: bulk_triage workers may all compile the same model at once
+    tmp = f"{directory}.tmp-{os.getpid()}-{threading.get_ident()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name in cls.ARRAYS:
+        np.save(os.path.join(tmp, name + ".npy"), np.ascontiguousarray(getattr(engine, name)))
+    with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "kind": kind,
+            "sha256": source_sha256,
+            "feature_columns": list(engine.feature_columns),
+            "classes": [str(c) for c in engine.classes_],
+            "scalars": {name: getattr(engine, name) for name in cls.SCALARS},
+            "temperature": float(engine.temperature),
+        }, f)
+    # A complete copy already there holds the same (digest-keyed) arrays, possibly
+    # written by another process meanwhile and already mapped by it: keep it
+    installed = os.path.join(directory, "meta.json")
+    if not os.path.exists(installed):
+        shutil.rmtree(directory, ignore_errors=True)
+        try:
+            os.replace(tmp, directory)
+        except OSError:
+            if not os.path.exists(installed):
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+    shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_compiled(directory: str):
+    # Raises OSError/ValueError for a missing or unreadable artifact
+    with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    cls = COMPILED_KINDS.get(meta.get("kind"))
+    if cls is None:
+        raise ValueError(f"{directory}: unknown engine kind {meta.get('kind')!r}")
+    # Plain ndarray views of the mapping: np.memmap's subclass hooks cost more than
+    # the forest's per-row gathers themselves
+    arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode="r").view(np.ndarray)
+              for name in cls.ARRAYS}
+    engine = cls(meta["feature_columns"], meta["classes"], **arrays, **meta["scalars"])
+    engine.temperature = float(meta.get("temperature", 1.0))
+    return engine
+
+
+def compile_engine(engine, model_path: str, digest: str, cache_dir: str = CACHE_DIR) -> Optional[str]:
+    # -> the compiled directory, or None for engines without a memory-mapped form
+    # (e.g. an arbitrary sklearn estimator, which is always loaded unpickled).
+    # Artifacts of earlier versions of the same model file are removed.
+    if not any(type(engine) is c for c in COMPILED_KINDS.values()):
+        return None
+    target = compiled_path(model_path, digest, cache_dir)
+    save_compiled(engine, target, digest)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    older = re.compile(re.escape(stem) + r"-[0-9a-f]{8}" + re.escape(COMPILED_SUFFIX))
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if older.fullmatch(name) and path != target:
+            shutil.rmtree(path, ignore_errors=True)
+    return target
+
+
+# -----------------------------
+# Prediction cache
+# -----------------------------
+# All model inputs are binary, so a packed 132-bit int identifies an input exactly.
+# Real traffic repeats a few dozen symptom combinations, so most forest
+# evaluations can be answered from a small shared LRU.
+class PredictionCache:
+    def __init__(self, maxsize: int = PREDICTION_CACHE_SIZE):
+        self.maxsize = int(maxsize)
+        self._data: "OrderedDict[int, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: int) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: int, value: np.ndarray) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+
+class CachedEngine:
+    # Wraps an engine; single-row predict/predict_proba go through the cache,
+    # everything else (batch calls, attributes) is passed straight through.
+    def __init__(self, engine, maxsize: int = PREDICTION_CACHE_SIZE):
+        self.engine = engine
+        self.cache = PredictionCache(maxsize)
+        add_collector("prediction_cache", self._metrics)
+
+    def _metrics(self):
+        stats = self.cache.stats()
+        return [
+            ("healthmate_prediction_cache_hits_total", "counter", {}, stats["hits"]),
+            ("healthmate_prediction_cache_misses_total", "counter", {}, stats["misses"]),
+            ("healthmate_prediction_cache_evictions_total", "counter", {}, stats["evictions"]),
+            ("healthmate_prediction_cache_entries", "gauge", {}, stats["size"]),
+        ]
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def predict_proba(self, features: Features) -> np.ndarray:
+        with timed("predict"):
+            key = int(features) if isinstance(features, (int, np.integer)) else pack_features(features)
+            proba = self.cache.get(key)
+            if proba is None:
+                proba = self.engine.predict_proba(key)
+                proba.setflags(write=False)  # shared between sessions
+                self.cache.put(key, proba)
+        return proba
+
+    def predict(self, features: Features) -> str:
+        return self.engine.classes_[int(self.predict_proba(features).argmax())]
+
+    def top_k(self, features: Features, k: int = DIFFERENTIAL_SIZE) -> List[Tuple[str, float]]:
+        # Ranked from the cached probabilities (no second model pass)
+        return differential(self.engine, self.predict_proba(features)[None, :], k)[0]
+
+
+def _open_engine(path: str, cache_dir: str) -> Tuple[Any, str]:
+    # -> (engine, how it was loaded). `path` is model.joblib or a compiled .engine directory.
+    if os.path.isdir(path):
+        return load_compiled(path), "memory-mapped"
+    digest = file_sha256(path)
+    compiled = compiled_path(path, digest, cache_dir)
+    if os.path.exists(os.path.join(compiled, "meta.json")):
+        try:
+            return load_compiled(compiled), "memory-mapped"
+        except (OSError, ValueError, KeyError, TypeError) as exc:
+            print(f"⚠️ Ignoring compiled model {compiled}: {exc}", file=sys.stderr)
+            shutil.rmtree(compiled, ignore_errors=True)  # rebuilt below
+    import joblib  # only needed (with scikit-learn) when there is no compiled copy yet
+
+    engine = engine_from_payload(joblib.load(path))
+    try:
+        target = compile_engine(engine, path, digest, cache_dir)
+    except OSError as exc:  # read-only cache dir: still serve, just without the fast path next time
+        print(f"⚠️ Could not write compiled model to {cache_dir}: {exc}", file=sys.stderr)
+        target = None
+    return engine, "unpickled" + (", compiled for next start" if target else "")
+
+
+def load_engine(path: str = MODEL_PATH, cache_size: int = PREDICTION_CACHE_SIZE, cache_dir: str = CACHE_DIR):
+    start = time.perf_counter()
+    engine, how = _open_engine(path, cache_dir)
+    record_startup("model_load", time.perf_counter() - start, how)
+    if cache_size > 0:
+        engine = CachedEngine(engine, cache_size)
+    return engine
+
+
+# -----------------------------
+# Process-wide engine + warm-up
+# -----------------------------
+_shared: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+_shared_lock = threading.Lock()
+
+
+def _file_stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def shared_engine(path: str = MODEL_PATH):
+    # One cached engine per model file per process (every app session and the
+    # warm-up thread), reloaded when the file is replaced (train_model.py swaps it)
+    stamp = _file_stamp(path)
+    entry = _shared.get(path)
+    if entry is None or entry[0] != stamp:
+        with _shared_lock:  # a request arriving mid warm-up waits for it instead of loading twice
+            entry = _shared.get(path)
+            if entry is None or entry[0] != stamp:
+                entry = (stamp, load_engine(path))
+                _shared[path] = entry
+    return entry[1]
+
+
+def warm_up(path: str = MODEL_PATH, languages: Sequence[Optional[str]] = (None,)) -> Optional[threading.Thread]:
+    # Loads the model, compiles the keyword matchers and builds the referral index
+    # in a daemon thread, so a woken-up host is ready before the first button press
+    if not WARMUP:
+        return None
+
+    def run():
+        from facilities import load_facilities
+
+        start = time.perf_counter()
+        try:
+            engine = shared_engine(path)
+            engine.predict_proba_batch(np.zeros((1, engine.n_features)))  # fault in the mapped pages
+            t = time.perf_counter()
+            rules = current_rules()
+            for language in languages:
+                rules.matcher(tuple(engine.feature_columns), language)
+            record_startup("matchers", time.perf_counter() - t)
+            t = time.perf_counter()
+            load_facilities()
+            record_startup("referral_index", time.perf_counter() - t)
+        except Exception as exc:  # the first request will load (and report) it instead
+            print(f"⚠️ Warm-up failed: {exc}", file=sys.stderr)
+            return
+        record_startup("warm_up", time.perf_counter() - start)
+        print(f"⏱️ Startup: {startup_report()}", file=sys.stderr)
+
+    thread = threading.Thread(target=run, name="healthmate-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+# -----------------------------
+# Startup timing report
+# -----------------------------
+# First value per stage in this process, e.g. {"model_load": (0.012, "memory-mapped")}
+STARTUP: Dict[str, Tuple[float, str]] = {}
+
+
+def record_startup(stage: str, seconds: float, note: str = "") -> None:
+    if stage not in STARTUP:
+        STARTUP[stage] = (seconds, note)
+
+
+def startup_report() -> str:
+    return ", ".join(f"{stage} {s:.3f}s" + (f" ({note})" if note else "") for stage, (s, note) in STARTUP.items())
+
+
+add_collector("startup", lambda: [
+    ("healthmate_startup_seconds", "gauge", {"stage": stage}, round(s, 6)) for stage, (s, _) in STARTUP.items()
+])
+
+
+if __name__ == "__main__":
+    # Pre-build the memory-mapped artifact (e.g. in the deploy step) and compare load times
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile a model artifact for memory-mapped loading")
+    parser.add_argument("model", nargs="?", default=MODEL_PATH)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+
+    import joblib
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    start = time.perf_counter()
+    engine = engine_from_payload(joblib.load(args.model))
+    unpickled = time.perf_counter() - start
+    digest = file_sha256(args.model)
+    shutil.rmtree(compiled_path(args.model, digest, args.cache_dir), ignore_errors=True)  # always rebuild
+    target = compile_engine(engine, args.model, digest, args.cache_dir)
+    if target is None:
+        print(f"⚠️ {args.model}: this model type has no memory-mapped form; it is loaded unpickled")
+        sys.exit(0)
+    start = time.perf_counter()
+    load_compiled(target)
+    print(f"✅ {target}: loads in {time.perf_counter() - start:.3f}s memory-mapped "
+          f"(vs {unpickled:.3f}s unpickled + converted)")
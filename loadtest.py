@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from benchmark import FILLER, random_answers, testing_cases
+from inference import DIFFERENTIAL_SIZE, MODEL_PATH, pack_features, shared_engine, symptoms_to_features
+from triage_engine import triage
+from triage_rules import current_rules
+
+# The app's three quick demo buttons
+PRESETS = [
+    "mild headache and fever since yesterday",
+    "fever and vomiting for four days",
+    "chest tightness and difficulty breathing",
+]
+DEFAULT_MIX = "presets=0.5,testing=0.3,long=0.2"
+DEFAULT_LEVELS = "1,2,4,8,16,32"
+
+# Rough bounding box of Uganda, for cases that share a location
+LAT_RANGE = (-1.4, 4.2)
+LON_RANGE = (29.6, 35.0)
+
+
+# -----------------------------
+# Inputs
+# -----------------------------
+def long_texts(n: int, seed: int = 0) -> List[str]:
+    # Multi-kilobyte notes: symptoms buried in community-health-worker filler
+    rng = random.Random(seed)
+    phrases = [w for words in current_rules().keywords.values() for w in words]
+    return [". ".join(rng.choice(phrases) if rng.random() < 0.2 else rng.choice(FILLER) for _ in range(150))
+            for _ in range(n)]
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("presets", "testing", "long"):
+            raise ValueError(f"unknown input kind '{name.strip()}' (use presets, testing, long)")
+        mix[name.strip()] = float(weight)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("--mix needs at least one positive weight")
+    return mix
+
+
+def build_cases(mix: Dict[str, float], n: int, location_share: float, seed: int = 1) -> List[Dict[str, Any]]:
+    # A fixed pool of n cases drawn according to the mix; sessions sample from it
+    rng = random.Random(seed)
+    texts = {"presets": PRESETS, "testing": testing_cases() if mix.get("testing") else [],
+             "long": long_texts(50) if mix.get("long") else []}
+    kinds = [k for k in mix if mix[k] > 0 and texts[k]]
+    cases = []
+    for _ in range(n):
+        kind = rng.choices(kinds, weights=[mix[k] for k in kinds])[0]
+        location = None
+        if rng.random() < location_share:
+            location = (rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE))
+        cases.append({"kind": kind, "symptom_text": rng.choice(texts[kind]), "age": rng.randint(0, 90),
+                      "sex": "Female", "pregnant": rng.random() < 0.1, "answers": random_answers(rng),
+                      "location": location})
+    return cases
+
+
+# -----------------------------
+# One app request
+# -----------------------------
+def app_request(case: Dict[str, Any], model_path: str) -> Tuple[Tuple[Any, ...], float]:
+    # The path a button press takes in app.py: one RuleSet for the request, one
+    # scan for features + flags, the shared model's ranked differential, then triage.
+    # -> (outcome for the correctness check, seconds spent in predict)
+    rules = current_rules()
+    engine = shared_engine(model_path)
+    features, flags = symptoms_to_features(case["symptom_text"], engine.feature_columns, None, rules)
+    t0 = time.perf_counter()
+    ranked = engine.top_k(pack_features(features), DIFFERENTIAL_SIZE)
+    predict_s = time.perf_counter() - t0
+    res = triage(symptom_text="", age=case["age"], sex=case["sex"], pregnant=case["pregnant"],
+                 answers=case["answers"], flags=flags, rules=rules, location=case["location"],
+                 confidence=ranked[0][1])
+    return (ranked[0][0], res.level, res.reason_ids, res.referrals, tuple(ranked)), predict_s
+
+
+def expected_outcomes(cases: List[Dict[str, Any]], model_path: str) -> List[Tuple[Any, ...]]:
+    # Computed one at a time against the uncached model: the reference every
+    # concurrent answer must match exactly
+    engine = shared_engine(model_path)
+    raw = getattr(engine, "engine", engine)
+    out = []
+    for case in cases:
+        features, flags = symptoms_to_features(case["symptom_text"], engine.feature_columns)
+        ranked = raw.top_k(features, DIFFERENTIAL_SIZE)
+        res = triage(symptom_text="", age=case["age"], sex=case["sex"], pregnant=case["pregnant"],
+                     answers=case["answers"], flags=flags, location=case["location"], confidence=ranked[0][1])
+        out.append((ranked[0][0], res.level, res.reason_ids, res.referrals, tuple(ranked)))
+    return out
+
+
+# -----------------------------
+# Process resources
+# -----------------------------
+def rss_mb() -> Optional[float]:
+    # Current resident set size; peak RSS where /proc is missing; None on Windows
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+# -----------------------------
+# Load levels
+# -----------------------------
+def run_level(concurrency: int, duration_s: float, cases: List[Dict[str, Any]],
+              expected: List[Tuple[Any, ...]], model_path: str, think_ms: float, seed: int) -> Dict[str, Any]:
+    # `concurrency` sessions (threads, as Streamlit runs each session's script)
+    # press the button in a closed loop, optionally pausing `think_ms` in between
+    engine = shared_engine(model_path)
+    cache = getattr(engine, "cache", None)
+    if cache is not None:
+        cache.clear()  # every level starts cold, like a freshly woken process
+    stats0 = cache.stats() if cache is not None else None
+
+    lock = threading.Lock()
+    latencies: List[float] = []
+    predict_times: List[float] = []
+    mismatches: List[str] = []
+    errors: List[str] = []
+    engines = set()
+    start_gate = threading.Barrier(concurrency + 1)
+    deadline = [0.0]
+
+    def session(idx: int):
+        rng = random.Random(seed * 1000 + idx)
+        lat, pred, bad, err = [], [], [], []
+        engines_seen = {id(shared_engine(model_path))}
+        start_gate.wait()
+        while time.perf_counter() < deadline[0]:
+            i = rng.randrange(len(cases))
+            t0 = time.perf_counter()
+            try:
+                outcome, predict_s = app_request(cases[i], model_path)
+            except Exception as exc:
+                err.append(f"{type(exc).__name__}: {exc}")
+                continue
+            lat.append(time.perf_counter() - t0)
+            pred.append(predict_s)
+            if outcome != expected[i]:
+                bad.append(f"case {i}: got {outcome[:2]}, expected {expected[i][:2]}")
+            if think_ms:
+                time.sleep(rng.expovariate(1000.0 / think_ms))
+        with lock:
+            latencies.extend(lat)
+            predict_times.extend(pred)
+            mismatches.extend(bad)
+            errors.extend(err)
+            engines.update(engines_seen)
+
+    threads = [threading.Thread(target=session, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    rss_peak = rss_mb()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    deadline[0] = wall0 + duration_s
+    start_gate.wait()
+    while any(t.is_alive() for t in threads):
+        time.sleep(0.1)
+        rss = rss_mb()
+        if rss is not None and (rss_peak is None or rss > rss_peak):
+            rss_peak = rss
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+
+    lat_ms = np.asarray(latencies) * 1000.0
+    p50, p95, p99 = np.percentile(lat_ms, [50, 95, 99]) if len(lat_ms) else (float("nan"),) * 3
+    out = {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_per_s": len(latencies) / wall,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(lat_ms.max()) if len(lat_ms) else float("nan"),
+        "predict_p99_us": float(np.percentile(predict_times, 99) * 1e6) if predict_times else float("nan"),
+        "cpu_percent": 100.0 * cpu / wall,
+        "rss_peak_mb": rss_peak,
+        "mismatches": len(mismatches),
+        "errors": len(errors),
+        "engines": len(engines),
+        "examples": (mismatches + errors)[:5],
+    }
+    if cache is not None:
+        stats = cache.stats()
+        hits, misses = stats["hits"] - stats0["hits"], stats["misses"] - stats0["misses"]
+        out["cache_hit_rate"] = hits / (hits + misses) if hits + misses else 0.0
+    return out
+
+
+def print_report(levels: List[Dict[str, Any]]) -> None:
+    print(f"{'sessions':>8}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+          f"{'predict p99 µs':>16}{'CPU %':>8}{'RSS MB':>9}{'cache hit':>11}{'wrong':>7}")
+    for r in levels:
+        rss = f"{r['rss_peak_mb']:.0f}" if r["rss_peak_mb"] is not None else "n/a"
+        hit = f"{r['cache_hit_rate']:.0%}" if "cache_hit_rate" in r else "n/a"
+        print(f"{r['concurrency']:>8}{r['throughput_per_s']:>10.0f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}"
+              f"{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}{r['predict_p99_us']:>16.0f}{r['cpu_percent']:>8.0f}"
+              f"{rss:>9}{hit:>11}{r['mismatches'] + r['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test the app's request path with many simultaneous sessions in one process")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--concurrency", default=DEFAULT_LEVELS, help="comma-separated session counts")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="input mix, e.g. presets=1 or testing=0.7,long=0.3")
+    parser.add_argument("--cases", type=int, default=500, help="size of the case pool sessions draw from")
+    parser.add_argument("--location-share", type=float, default=0.2, help="share of cases with a location")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's requests")
+    parser.add_argument("--slo-ms", type=float, default=500.0, help="p95 latency target for the sizing line")
+    parser.add_argument("--save", metavar="PATH", help="write results as JSON")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        levels = [int(c) for c in args.concurrency.split(",")]
+    except ValueError as exc:
+        parser.error(str(exc))
+    if not os.path.exists(args.model):
+        sys.exit(f"❌ {args.model} not found (run train_model.py first)")
+
+    load_start = time.perf_counter()
+    shared_engine(args.model)
+    cases = build_cases(mix, args.cases, args.location_share)
+    expected = expected_outcomes(cases, args.model)
+    print(f"✅ {len(cases)} cases ({', '.join(f'{k}={v:g}' for k, v in mix.items())}), reference answers "
+          f"computed in {time.perf_counter() - load_start:.1f}s; {os.cpu_count()} CPU(s), "
+          f"Python {platform.python_version()}")
+
+    results = []
+    for n in levels:
+        results.append(run_level(n, args.duration, cases, expected, args.model, args.think_ms, seed=n))
+    print_report(results)
+
+    within = [r["concurrency"] for r in results if r["p95_ms"] <= args.slo_ms and not r["errors"]]
+    if within:
+        print(f"✅ p95 ≤ {args.slo_ms:.0f} ms up to {max(within)} simultaneous sessions "
+              f"(think time {args.think_ms:.0f} ms)")
+    else:
+        print(f"⚠️ p95 exceeded {args.slo_ms:.0f} ms at every tested concurrency")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"meta": {"python": platform.python_version(), "cpus": os.cpu_count(),
+                                "mix": mix, "cases": len(cases), "duration_s": args.duration,
+                                "think_ms": args.think_ms},
+                       "levels": results}, f, indent=2)
+        print(f"✅ Results saved to {args.save}")
+
+    shared = [r for r in results if r["engines"] > 1]
+    wrong = [r for r in results if r["mismatches"] or r["errors"]]
+    if shared or wrong:
+        for r in wrong:
+            print(f"❌ {r['concurrency']} sessions: {r['mismatches']} wrong answers, {r['errors']} errors, "
+                  f"e.g. {r['examples'][:2]}")
+        for r in shared:
+            print(f"❌ {r['concurrency']} sessions saw {r['engines']} different model objects (expected 1)")
+        sys.exit(1)
+    print("✅ Every concurrent answer matched the single-threaded reference; one shared model object")
+
+
+if __name__ == "__main__":
+    main()
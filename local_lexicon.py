@@ -0,0 +1,30 @@
+import json
+import os
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+LEXICON_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "lexicon")
+
+# Language codes with a synonym table in data/lexicon/<code>.json
+LANGUAGES = {
+    "lg": "Luganda",
+    "sw": "Swahili",
+    "nyn": "Runyankole/Rukiga",
+}
+
+
+# Tables are read from disk on first use of a language only, so adding
+# languages costs nothing for sessions that never use them.
+@lru_cache(maxsize=None)
+def load_synonyms(language: Optional[str]) -> Dict[str, Dict[str, List[str]]]:
+    # -> {phrase: {"flags": [...], "features": [...]}}; English needs no table
+    if language in (None, "", "en"):
+        return {}
+    if language not in LANGUAGES:
+        raise ValueError(f"Unsupported language '{language}'. Supported: {sorted(LANGUAGES)}")
+    with open(os.path.join(LEXICON_DIR, f"{language}.json"), encoding="utf-8") as f:
+        table = json.load(f)["synonyms"]
+    return {
+        phrase.lower(): {"flags": list(t.get("flags", [])), "features": list(t.get("features", []))}
+        for phrase, t in table.items()
+    }
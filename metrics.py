@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Set HEALTHMATE_METRICS=0 to turn every hook into a no-op
+ENABLED = os.environ.get("HEALTHMATE_METRICS", "1") != "0"
+
+# Seconds; fine-grained at the bottom because most stages take microseconds
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Timer:
+    __slots__ = ("hist", "start")
+
+    def __init__(self, hist: Histogram):
+        self.hist = hist
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    def __init__(self):
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], int] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: Dict[str, Callable[[], List[Tuple[str, str, Dict[str, str], float]]]] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> Histogram:
+        hist = self._stages.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self._stages.setdefault(name, Histogram())
+        return hist
+
+    def inc(self, name: str, amount: int = 1, help: str = "", **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            if help:
+                self._help.setdefault(name, help)
+
+    def add_collector(self, key: str, fn: Callable[[], List[Tuple[str, str, Dict[str, str], float]]]) -> None:
+        # fn() -> [(metric name, "counter" | "gauge", labels, value), ...] read at export time;
+        # registering the same key again replaces the previous collector
+        with self._lock:
+            self._collectors[key] = fn
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+            self._collectors.clear()
+
+    def render_prometheus(self) -> str:
+        lines = [
+            "# HELP healthmate_stage_seconds Time spent in each request pipeline stage.",
+            "# TYPE healthmate_stage_seconds histogram",
+        ]
+        for stage, hist in sorted(self._stages.items()):
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for bound, c in zip(hist.buckets, counts):
+                cumulative += c
+                lines.append(f'healthmate_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'healthmate_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'healthmate_stage_seconds_sum{{stage="{stage}"}} {total:.9f}')
+            lines.append(f'healthmate_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            collectors = list(self._collectors.values())
+        samples = [(name, "counter", dict(labels), value) for (name, labels), value in counters]
+        for fn in collectors:
+            samples.extend(fn())
+
+        typed = set()
+        for name, kind, labels, value in samples:
+            if name not in typed:
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            label_str = ",".join(f'{k}="{v}"' for k, v in sorted(labels.items()))
+            lines.append(f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def timed(stage: str):
+    # with timed("detect_flags"): ...
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(REGISTRY.stage(stage))
+
+
+def inc(name: str, amount: int = 1, help: str = "", **labels: str) -> None:
+    if ENABLED:
+        REGISTRY.inc(name, amount, help, **labels)
+
+
+def add_collector(key: str, fn) -> None:
+    if ENABLED:
+        REGISTRY.add_collector(key, fn)
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render_prometheus()
+
+
+def write_textfile(path: str) -> None:
+    # Atomic replace, so node_exporter's textfile collector never reads a partial file
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+
+
+_exporter: Optional[threading.Thread] = None
+
+
+def start_file_exporter(path: str, interval_s: float = 15.0) -> None:
+    # Background snapshot writer for processes without an HTTP endpoint (the Streamlit app)
+    global _exporter
+    if not ENABLED or _exporter is not None:
+        return
+
+    def loop():
+        while True:
+            time.sleep(interval_s)
+            try:
+                write_textfile(path)
+            except OSError:
+                pass
+
+    _exporter = threading.Thread(target=loop, name="healthmate-metrics-exporter", daemon=True)
+    _exporter.start()
@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import audit
+from facilities import check_location, load_facilities
+from inference import (DIFFERENTIAL_SIZE, MODEL_PATH, STARTUP, differential, pack_features, shared_engine,
+                       startup_report, symptoms_to_features)
+from metrics import inc, render_prometheus, timed
+from sms_codec import encode_result
+from triage_engine import parse_age, triage
+from triage_rules import RULES_PATH, current_rules, use_rules_file
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+# -----------------------------
+# Micro-batched model inference
+# -----------------------------
+# Requests that arrive within `window_ms` of each other are grouped into one
+# batched forest evaluation, run off the event loop in a worker thread. Each
+# request brings the engine it started with, so a batch straddling a model swap
+# is evaluated as one group per engine.
+class MicroBatcher:
+    def __init__(self, window_ms: float = 5.0, max_batch: int = 256, max_queue: int = 2048):
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue: "asyncio.Queue[Tuple[Any, List[int], asyncio.Future]]" = asyncio.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.rejected = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    @property
+    def depth(self) -> int:
+        return self.queue.qsize()
+
+    def submit(self, engine, features: List[int]) -> "asyncio.Future":
+        # Raises asyncio.QueueFull when the queue is at its limit (backpressure)
+        fut = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((engine, features, fut))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        return fut
+
+    @staticmethod
+    def _predict_batch(engine, X: np.ndarray) -> np.ndarray:
+        with timed("predict_batch"):
+            return engine.predict_proba_batch(X)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            inc("healthmate_batch_rows_total", len(batch), help="Rows evaluated by the micro-batcher.")
+            groups: Dict[int, List[Tuple[Any, List[int], asyncio.Future]]] = {}
+            for item in batch:
+                groups.setdefault(id(item[0]), []).append(item)
+            for group in groups.values():
+                await self._evaluate(loop, group)
+            self.batches += 1
+
+    async def _evaluate(self, loop: asyncio.AbstractEventLoop,
+                        group: List[Tuple[Any, List[int], asyncio.Future]]) -> None:
+        engine = group[0][0]
+        X = np.zeros((len(group), len(engine.feature_columns)), dtype=np.float64)
+        for i, (_, features, _) in enumerate(group):
+            X[i, features] = 1.0
+        try:
+            proba = await loop.run_in_executor(None, self._predict_batch, engine, X)
+        except Exception as exc:  # fail the whole group, keep serving
+            for _, _, fut in group:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+
+        cache = getattr(engine, "cache", None)
+        for (_, features, fut), p in zip(group, proba):
+            if cache is not None:
+                p.setflags(write=False)
+                cache.put(pack_features(features), p)
+            if not fut.done():
+                fut.set_result(p)
+
+
+# -----------------------------
+# Minimal HTTP/1.1 front end
+# -----------------------------
+class TriageServer:
+    def __init__(self, model_path: str, batcher: MicroBatcher):
+        self.model_path = model_path
+        self.batcher = batcher
+
+    @property
+    def engine(self):
+        # The process-wide engine for model_path, reloaded when train_model.py swaps the file
+        return shared_engine(self.model_path)
+
+    async def predict(self, engine, features: List[int]) -> List[Tuple[str, float]]:
+        # -> ranked differential [(prognosis, calibrated probability), ...] from one model pass
+        cache = getattr(engine, "cache", None)
+        proba = cache.get(pack_features(features)) if cache is not None else None
+        if proba is None:
+            proba = await self.batcher.submit(engine, features)
+        return differential(engine, proba[None, :], DIFFERENTIAL_SIZE)[0]
+
+    async def handle_triage(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        symptom_text = body.get("symptom_text") or ""
+        if not isinstance(symptom_text, str) or not symptom_text.strip():
+            return 400, {"error": "symptom_text is required"}
+        try:
+            age = parse_age(body.get("age", 28))
+        except ValueError as exc:
+            return 400, {"error": str(exc)}
+        # JSON booleans only: "false" is a non-empty string and would count as yes
+        pregnant = body.get("pregnant", False)
+        if not isinstance(pregnant, bool):
+            return 400, {"error": "pregnant must be true or false"}
+        answers = body.get("answers") or {}
+        if not isinstance(answers, dict) or not all(isinstance(v, bool) for v in answers.values()):
+            return 400, {"error": "answers must be an object of question -> true/false"}
+        language = body.get("language")
+        if language is not None and not isinstance(language, str):
+            return 400, {"error": "language must be a language code string"}
+        location = None
+        if body.get("lat") is not None or body.get("lon") is not None:
+            try:
+                location = (float(body["lat"]), float(body["lon"]))
+                check_location(*location)
+            except (KeyError, TypeError, ValueError, OverflowError):
+                return 400, {"error": "lat and lon must both be given as decimal degrees"}
+
+        # Picked up once, so a rules or model reload mid-request cannot mix two versions
+        rules, engine = current_rules(), self.engine
+        try:
+            features, flags = symptoms_to_features(symptom_text, engine.feature_columns, language, rules)
+        except ValueError as exc:  # unsupported language code
+            return 400, {"error": str(exc)}
+        try:
+            ranked = await self.predict(engine, features)
+        except asyncio.QueueFull:
+            return 503, {"error": "server busy", "queue_depth": self.batcher.depth}
+        prediction, confidence = ranked[0]
+
+        sex = str(body.get("sex", ""))
+        res = triage(symptom_text=symptom_text, age=age, sex=sex, pregnant=pregnant, answers=answers, flags=flags,
+                     rules=rules, location=location, confidence=confidence)
+        audit.record("server", res, symptom_text=symptom_text, age=age, sex=sex, pregnant=pregnant,
+                     answers=answers, flags=flags, prediction=prediction, language=language,
+                     location=location, differential=[list(d) for d in ranked])
+        return 200, {
+            "prediction": prediction,
+            "differential": [{"prognosis": label, "probability": round(p, 4)} for label, p in ranked],
+            "triage": res.as_dict(),
+            "code": encode_result(res),
+        }
+
+    def health(self) -> Dict[str, Any]:
+        sink = audit.get_sink()
+        return {
+            "status": "ok",
+            "rule_version": current_rules().version,
+            "queue_depth": self.batcher.depth,
+            "max_queue": self.batcher.queue.maxsize,
+            "batches": self.batcher.batches,
+            "rejected": self.batcher.rejected,
+            "audit_dropped": sink.dropped if sink is not None else None,
+            "startup_seconds": {stage: round(s, 4) for stage, (s, _) in STARTUP.items()},
+        }
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "bad request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self._respond(writer, 400, {"error": "bad Content-Length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {"error": "request body too large"}, keep_alive=False)
+                    break
+                raw = await reader.readexactly(length) if length else b""
+
+                try:
+                    status, payload = await self.route(method, path, raw)
+                except Exception as exc:  # a bug in one request must not drop the connection silently
+                    print(f"⚠️ {method} {path} failed: {exc!r}", file=sys.stderr)
+                    status, payload = 500, {"error": "internal server error"}
+                inc("healthmate_http_requests_total", help="HTTP requests by status code.", status=str(status))
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, raw: bytes) -> Tuple[int, Any]:
+        if path == "/healthz" and method == "GET":
+            return 200, self.health()
+        if path == "/metrics" and method == "GET":
+            return 200, render_prometheus()
+        if path == "/triage" and method == "POST":
+            try:
+                with timed("parse"):
+                    body = json.loads(raw or b"{}")
+            except ValueError:
+                return 400, {"error": "body must be JSON"}
+            if not isinstance(body, dict):
+                return 400, {"error": "body must be a JSON object"}
+            return await self.handle_triage(body)
+        return 404, {"error": "not found"}
+
+    async def _respond(self, writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool) -> None:
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+                   500: "Internal Server Error", 503: "Service Unavailable"}
+        if isinstance(payload, str):  # Prometheus text exposition
+            body = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        head = [
+            f"HTTP/1.1 {status} {reasons.get(status, 'OK')}",
+            f"Content-Type: {content_type}",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if status == 503:
+            head.append("Retry-After: 1")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(host: str, port: int, model_path: str, window_ms: float, max_batch: int, max_queue: int,
+                rules_path: str = RULES_PATH, audit_dir: str = audit.AUDIT_DIR) -> None:
+    rules = use_rules_file(rules_path).current()
+    sink = audit.use_audit_dir(audit_dir)
+    shared_engine(model_path)  # load now; later swaps of the file are picked up per request
+    load_facilities()  # build the referral index before the first request
+    batcher = MicroBatcher(window_ms=window_ms, max_batch=max_batch, max_queue=max_queue)
+    app = TriageServer(model_path, batcher)
+    batcher.start()
+    server = await asyncio.start_server(app.handle_connection, host, port)
+    print(f"✅ HealthMate triage service listening on http://{host}:{port} "
+          f"(POST /triage, GET /healthz, GET /metrics; rules {rules.version} and {model_path} reloaded on change)")
+    print(f"⏱️ Startup: {startup_report()}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await batcher.stop()
+        if sink is not None:
+            sink.close()  # write out queued audit records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HealthMate triage service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--rules", default=RULES_PATH, help="triage rules file, re-read when it changes")
+    parser.add_argument("--audit-dir", default=audit.AUDIT_DIR, help="rotating audit log directory")
+    parser.add_argument("--batch-window-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch", type=int, default=256)
+    parser.add_argument("--max-queue", type=int, default=2048)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.model, args.batch_window_ms, args.max_batch, args.max_queue,
+                          args.rules, args.audit_dir))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
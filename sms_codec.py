@@ -0,0 +1,114 @@
+import argparse
+import re
+from typing import List
+
+from facilities import load_facilities
+from triage_engine import LEVELS, TriageResult
+from triage_rules import resolve_version, version_key
+
+# Short codes for feature phones on metered links. A result is sent as
+#
+#   HM1*U*0703cb0b*3F*Z-D*1C-2A
+#   |   | |        |  '-- referrals: facility row - distance in 0.1 km (base 36)
+#   |   | |        '-- fired reasons: bitmask over the rule set's reasons (base 36)
+#   |   | '-- rule version (content hash)
+#   |   '-- level: S / C / U
+#   '-- format tag
+#
+# Only GSM-7 characters are used, so a code costs 7 bits per character and
+# always fits in a single SMS (160) or USSD page (182). Texts are not sent:
+# the receiver expands the IDs against the same rules and facility files.
+FORMAT_TAG = "HM1"
+SEP = "*"
+SMS_LIMIT = 160
+USSD_LIMIT = 182
+
+LEVEL_CODES = {"SELF_CARE": "S", "CLINIC": "C", "URGENT": "U"}
+CODE_LEVELS = {v: k for k, v in LEVEL_CODES.items()}
+
+_DIGITS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+_CODE_RE = re.compile(r"[0-9A-Z]+")
+
+# Characters in our templates that would force a UCS-2 SMS (70 chars) instead of GSM-7 (160)
+_GSM_FALLBACKS = str.maketrans({"–": "-", "—": "-", "’": "'", "‘": "'", "“": '"', "”": '"', "≥": ">=", "≤": "<=",
+                                "…": "..."})
+
+
+def _b36(n: int) -> str:
+    if n < 0:
+        raise ValueError("negative value")
+    out = ""
+    while True:
+        n, r = divmod(n, 36)
+        out = _DIGITS[r] + out
+        if not n:
+            return out
+
+
+def _from_b36(s: str) -> int:
+    if not _CODE_RE.fullmatch(s):
+        raise ValueError(f"'{s}' is not a base-36 number")
+    return int(s, 36)
+
+
+def encode_result(result: TriageResult) -> str:
+    mask = 0
+    for i in result.reason_ids:
+        mask |= 1 << i
+    parts = [FORMAT_TAG, LEVEL_CODES[result.level], version_key(result.rule_version), _b36(mask)]
+    parts.extend(f"{_b36(row)}-{_b36(int(round(km * 10)))}" for row, km in result.referrals)
+    return SEP.join(parts)
+
+
+def decode_result(code: str) -> TriageResult:
+    # Raises ValueError for malformed codes and codes from unknown rule versions
+    parts = code.strip().split(SEP)
+    if len(parts) < 4 or parts[0] != FORMAT_TAG:
+        raise ValueError("not a HealthMate short code")
+    level = CODE_LEVELS.get(parts[1])
+    if level is None:
+        raise ValueError(f"unknown level code '{parts[1]}'")
+    try:
+        version, reasons = resolve_version(parts[2])
+    except KeyError:
+        raise ValueError(f"unknown rule version '{parts[2]}'") from None
+
+    mask = _from_b36(parts[3])
+    if mask >> len(reasons):
+        raise ValueError("reason index out of range for this rule version")
+    reason_ids = tuple(i for i in range(len(reasons)) if mask >> i & 1)
+
+    referrals = []
+    n_facilities = len(load_facilities().facilities) if len(parts) > 4 else 0
+    for part in parts[4:]:
+        row, _, tenths = part.partition("-")
+        row = _from_b36(row)
+        if row >= n_facilities:
+            raise ValueError(f"unknown facility {row}")
+        referrals.append((row, _from_b36(tenths) / 10))
+    return TriageResult(level, reason_ids, version, tuple(referrals))
+
+
+def render_sms(result: TriageResult, limit: int = SMS_LIMIT) -> str:
+    # Human-readable single message: level, first advice line, nearest facility and
+    # a short code (carrying only that facility) for follow-up lookups
+    code = encode_result(result._replace(referrals=result.referrals[:1]))
+    tail = f" Ref {code}"
+    lines: List[str] = [f"HealthMate: {LEVELS[result.level][0]}.", result.advice[0]]
+    if result.referrals:
+        row, km = result.referrals[0]
+        lines.append(f"Nearest: {load_facilities().facilities[row].name} ({km:.1f} km).")
+    text = " ".join(lines).translate(_GSM_FALLBACKS)
+    room = limit - len(tail)
+    if len(text) > room:
+        text = text[:max(0, room - 3)].rstrip() + "..."
+    return text + tail
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expand a HealthMate short code")
+    parser.add_argument("code")
+    args = parser.parse_args()
+    res = decode_result(args.code)
+    for key, value in res.as_dict().items():
+        print(f"{key}: {value}")
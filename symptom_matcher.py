@@ -0,0 +1,187 @@
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fuzzy_matcher import FUZZY_BUDGET_MS, FUZZY_MAX_EDITS, WORD_RE, FuzzyCorrector
+
+# Below this many phrases a substring test per phrase (C speed, stops at the
+# first phrase of each flag) beats walking the automaton in Python: the keyword
+# lists alone stay well under it, flags + feature columns go over it.
+AUTOMATON_MIN_PHRASES = 150
+
+
+# Multi-phrase matcher. Every phrase is tied to a triage flag and/or a model
+# feature index, so one scan of the lowercased text answers both detect_flags
+# and symptoms_to_features. Large phrase sets are compiled into an Aho-Corasick
+# automaton (one pass over the text); small ones are tested phrase by phrase.
+# Misspelt words are first corrected towards the phrase vocabulary (see
+# fuzzy_matcher) and the corrected text is scanned the same way.
+class SymptomMatcher:
+    def __init__(self, flag_names: Sequence[str], feature_columns: Sequence[str] = (),
+                 fuzzy_max_edits: int = FUZZY_MAX_EDITS, fuzzy_budget_ms: float = FUZZY_BUDGET_MS):
+        self.flag_names = list(flag_names)
+        self.feature_columns = list(feature_columns)
+        self.fuzzy_max_edits = fuzzy_max_edits
+        self.fuzzy_budget_ms = fuzzy_budget_ms
+        self._n_flags = len(self.flag_names)
+        self._flag_ids = {f: i for i, f in enumerate(self.flag_names)}
+        self._phrases: Dict[str, set] = {}
+        # (targets, phrases) for the substring path; phrases sharing targets are grouped
+        self._groups: List[Tuple[frozenset, Tuple[str, ...]]] = []
+        # goto[state] = {char: next_state}; out[state] = target ids ending here
+        self._goto: List[Dict[str, int]] = [{}]
+        self._out: List[frozenset] = [frozenset()]
+        self._fail: List[int] = [0]
+        self._automaton = False
+        self._vocabulary = set()
+        self._max_phrase_len = 0
+        self._corrector: Optional[FuzzyCorrector] = None
+        self._built = False
+
+    def add(self, phrase: str, flag: Optional[str] = None, feature: Optional[int] = None) -> None:
+        phrase = (phrase or "").lower()
+        if not phrase or (flag is None and feature is None):
+            return
+        if self._built:
+            raise RuntimeError("SymptomMatcher is already compiled; add phrases before the first scan.")
+
+        targets = set()
+        if flag is not None:
+            targets.add(self._flag_ids[flag])
+        if feature is not None:
+            targets.add(self._n_flags + int(feature))
+
+        self._vocabulary.update(WORD_RE.findall(phrase))
+        self._max_phrase_len = max(self._max_phrase_len, len(phrase))
+        self._phrases.setdefault(phrase, set()).update(targets)
+
+    def _insert(self, phrase: str, targets: frozenset) -> None:
+        state = 0
+        for ch in phrase:
+            nxt = self._goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][ch] = nxt
+                self._goto.append({})
+                self._out.append(frozenset())
+                self._fail.append(0)
+            state = nxt
+        self._out[state] = self._out[state] | targets
+
+    def build(self) -> "SymptomMatcher":
+        if self.fuzzy_max_edits > 0:
+            self._corrector = FuzzyCorrector(self._vocabulary, max_edits=self.fuzzy_max_edits)
+        self._built = True
+        self._automaton = len(self._phrases) >= AUTOMATON_MIN_PHRASES
+        if not self._automaton:
+            groups: Dict[frozenset, List[str]] = {}
+            for phrase, targets in self._phrases.items():
+                groups.setdefault(frozenset(targets), []).append(phrase)
+            self._groups = [(t, tuple(ps)) for t, ps in groups.items()]
+            return self
+
+        for phrase, targets in self._phrases.items():
+            self._insert(phrase, frozenset(targets))
+        # BFS over the trie to set failure links and merge outputs along them
+        queue = deque()
+        for nxt in self._goto[0].values():
+            self._fail[nxt] = 0
+            queue.append(nxt)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] | self._out[self._fail[nxt]]
+        return self
+
+    def _hits(self, text: str) -> set:
+        hits = set()
+        if not self._automaton:
+            for targets, phrases in self._groups:
+                if targets <= hits:
+                    continue
+                for phrase in phrases:
+                    if phrase in text:
+                        hits |= targets
+                        break
+            return hits
+
+        goto, fail, out = self._goto, self._fail, self._out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                hits |= out[state]
+        return hits
+
+    def scan(self, text: str, fuzzy: bool = True) -> Tuple[Dict[str, bool], List[int]]:
+        if not self._built:
+            self.build()
+        text = (text or "").lower()
+        hits = self._hits(text)
+        if fuzzy and self._corrector is not None:
+            # Exact hits are kept; corrections can only add matches. Any phrase that
+            # uses a corrected word lies within max_phrase_len of it, so only those
+            # windows of the corrected text are re-scanned.
+            fixed, spans = self._corrector.correct(text, self.fuzzy_budget_ms)
+            pad = self._max_phrase_len
+            window_start, window_end = None, None
+            for start, end in spans:
+                start, end = max(0, start - pad), end + pad
+                if window_end is not None and start <= window_end:
+                    window_end = end
+                    continue
+                if window_end is not None:
+                    hits |= self._hits(fixed[window_start:window_end])
+                window_start, window_end = start, end
+            if window_end is not None:
+                hits |= self._hits(fixed[window_start:window_end])
+
+        n_flags = self._n_flags
+        flags = {f: False for f in self.flag_names}
+        features = []
+        for t in hits:
+            if t < n_flags:
+                flags[self.flag_names[t]] = True
+            else:
+                features.append(t - n_flags)
+        features.sort()
+        return flags, features
+
+
+def feature_phrases(column: str) -> Iterable[str]:
+    # Same two spellings symptoms_to_features always accepted: the raw column name
+    # and the column with underscores as spaces. Some dataset columns carry stray
+    # spaces ("spotting_ urination", "dischromic _patches"), so the
+    # whitespace-collapsed form is matched as well.
+    yield column
+    yield column.replace("_", " ")
+    yield " ".join(column.replace("_", " ").split())
+
+
+def build_matcher(keywords: Dict[str, List[str]], feature_columns: Sequence[str] = (),
+                  synonyms: Optional[Dict[str, Dict[str, List[str]]]] = None) -> SymptomMatcher:
+    matcher = SymptomMatcher(keywords.keys(), feature_columns)
+    for flag, words in keywords.items():
+        for w in words:
+            matcher.add(w, flag=flag)
+    for i, c in enumerate(feature_columns):
+        for phrase in feature_phrases(c):
+            matcher.add(phrase, feature=i)
+
+    # Local-language phrases point at the same flags / feature columns
+    column_ids = {c: i for i, c in enumerate(feature_columns)}
+    for phrase, targets in (synonyms or {}).items():
+        for flag in targets.get("flags", ()):
+            if flag not in keywords:
+                raise ValueError(f"Synonym '{phrase}' refers to unknown flag '{flag}'")
+            matcher.add(phrase, flag=flag)
+        for column in targets.get("features", ()):
+            if column in column_ids:  # models trained on other columns simply skip it
+                matcher.add(phrase, feature=column_ids[column])
+    return matcher.build()
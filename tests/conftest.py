@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the top-level modules the same way the app and scripts do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,64 @@
+import pytest
+
+from fuzzy_matcher import FuzzyCorrector, WordList, bounded_levenshtein
+from triage_engine import detect_flags, triage
+
+
+def raised_flags(text):
+    return sorted(f for f, hit in detect_flags(text).items() if hit)
+
+
+# -----------------------------
+# Real words are never turned into symptoms
+# -----------------------------
+@pytest.mark.parametrize("word", [
+    "connection", "conclusion", "convention", "conversion", "confession", "configured",
+    "parsed", "paused", "pasted", "passes", "collapsing", "unreadable", "breeding", "seating",
+])
+def test_real_words_are_not_corrected(word):
+    assert raised_flags(f"she mentioned the {word} yesterday") == []
+
+
+def test_network_connection_is_not_confusion():
+    result = triage(symptom_text="poor network connection at home, mild cough", age=30, sex="female",
+                    pregnant=False, answers={})
+    assert result.level == "SELF_CARE"
+
+
+# -----------------------------
+# Typos still match
+# -----------------------------
+@pytest.mark.parametrize("typo, flag", [
+    ("vomitting", "vomiting"),
+    ("diarhea", "diarrhea"),
+    ("colapsed", "fainting"),
+    ("unbearible", "severe_pain"),
+    ("coughinng", "cough"),
+])
+def test_typos_are_corrected(typo, flag):
+    assert flag in raised_flags(f"patient {typo} since monday")
+
+
+def test_correction_must_beat_every_dictionary_word():
+    corrector = FuzzyCorrector(["confusion"], dictionary=WordList(["confession"]))
+    assert corrector.correct_word("confussion") is None
+    assert FuzzyCorrector(["confusion"], dictionary=WordList([])).correct_word("confussion") == "confusion"
+
+
+def test_dictionary_words_are_kept():
+    corrector = FuzzyCorrector(["passed"], dictionary=WordList(["parsed"]))
+    assert corrector.correct_word("parsed") is None
+    assert corrector.correct("parsed the file", budget_ms=50.0) == ("parsed the file", [])
+
+
+def test_correct_reports_replaced_spans():
+    corrector = FuzzyCorrector(["vomiting"], dictionary=WordList([]))
+    fixed, spans = corrector.correct("vomitting and vomitting", budget_ms=50.0)
+    assert fixed == "vomiting and vomiting"
+    assert [fixed[a:b] for a, b in spans] == ["vomiting", "vomiting"]
+
+
+def test_bounded_levenshtein():
+    assert bounded_levenshtein("kitten", "sitting", 3) == 3
+    assert bounded_levenshtein("kitten", "sitting", 2) == 3
+    assert bounded_levenshtein("abc", "abc", 0) == 0
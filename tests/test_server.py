@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import pytest
+
+from server import MicroBatcher, TriageServer
+
+
+def run_requests(requests, route=None):
+    # Starts a TriageServer on a free port, sends each raw request on its own
+    # connection and returns [(status, json body), ...]
+    async def main():
+        app = TriageServer("missing-model.joblib", MicroBatcher())
+        if route is not None:
+            app.route = route
+        server = await asyncio.start_server(app.handle_connection, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        responses = []
+        async with server:
+            for raw in requests:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write(raw)
+                await writer.drain()
+                head, _, body = (await reader.read()).partition(b"\r\n\r\n")
+                writer.close()
+                responses.append((int(head.split()[1]), json.loads(body)))
+        return responses
+    return asyncio.run(main())
+
+
+def post_triage(body):
+    raw = json.dumps(body).encode("utf-8")
+    return (b"POST /triage HTTP/1.1\r\nConnection: close\r\nContent-Length: %d\r\n\r\n" % len(raw)) + raw
+
+
+# -----------------------------
+# Bad input is a 400, never a dropped connection
+# -----------------------------
+@pytest.mark.parametrize("body, message", [
+    ({"age": 30}, "symptom_text"),
+    ({"symptom_text": ["fever"]}, "symptom_text"),
+    ({"symptom_text": "fever", "age": "thirty"}, "age"),
+    ({"symptom_text": "fever", "age": 1e300}, "age"),
+    ({"symptom_text": "fever", "age": 10 ** 400}, "age"),
+    ({"symptom_text": "fever", "age": -1}, "age"),
+    ({"symptom_text": "fever", "age": True}, "age"),
+    ({"symptom_text": "fever", "pregnant": "false"}, "pregnant"),
+    ({"symptom_text": "fever", "answers": {"confusion": "no"}}, "answers"),
+    ({"symptom_text": "fever", "answers": ["confusion"]}, "answers"),
+    ({"symptom_text": "fever", "language": ["sw"]}, "language"),
+    ({"symptom_text": "fever", "lat": 10 ** 400, "lon": 32.5}, "lat"),
+])
+def test_invalid_bodies_are_rejected(body, message):
+    [(status, payload)] = run_requests([post_triage(body)])
+    assert status == 400
+    assert message in payload["error"]
+
+
+def test_age_overflow_in_json_is_rejected():
+    raw = b'{"symptom_text": "fever", "age": 1e400}'
+    [(status, payload)] = run_requests([b"POST /triage HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(raw) + raw])
+    assert status == 400 and "age" in payload["error"]
+
+
+def test_bad_http_requests():
+    responses = run_requests([
+        b"POST /triage HTTP/1.1\r\nContent-Length: 7\r\n\r\nnotjson",
+        b"POST /triage HTTP/1.1\r\nContent-Length: -5\r\n\r\n",
+        b"POST /triage HTTP/1.1\r\nContent-Length: 999999999\r\n\r\n",
+        b"GET /nowhere HTTP/1.1\r\nConnection: close\r\n\r\n",
+        b"garbage\r\n\r\n",
+    ])
+    assert [status for status, _ in responses] == [400, 400, 413, 404, 400]
+
+
+def test_unexpected_errors_return_500():
+    async def broken_route(method, path, raw):
+        raise RuntimeError("boom")
+
+    [(status, payload)] = run_requests([b"GET /healthz HTTP/1.1\r\nConnection: close\r\n\r\n"], broken_route)
+    assert status == 500
+    assert payload == {"error": "internal server error"}
@@ -0,0 +1,67 @@
+import copy
+import json
+import random
+
+import pytest
+
+from triage_engine import MAX_REASONS, triage, triage_batch
+from triage_rules import RULES_PATH, compile_rules
+
+
+def load_config():
+    with open(RULES_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def random_cases(rules, n, seed=0):
+    rng = random.Random(seed)
+    phrases = [p for words in rules.keywords.values() for p in words] + ["walked two hours", "slept badly"]
+    cases = []
+    for _ in range(n):
+        case = {
+            "symptom_text": ", ".join(rng.choice(phrases) for _ in range(rng.randint(0, 6))),
+            "age": rng.randint(0, 95),
+            "sex": "female",
+            "pregnant": rng.random() < 0.2,
+            "answers": {k: rng.random() < 0.2 for k in rules.answer_keys},
+            "confidence": rng.random(),
+        }
+        if rng.random() < 0.3:
+            case["language"] = rng.choice(["sw", "lg"])
+        cases.append(case)
+    return cases
+
+
+# -----------------------------
+# triage_batch == triage, case by case
+# -----------------------------
+@pytest.mark.parametrize("with_confidence", [False, True])
+def test_batch_matches_single_triage(with_confidence):
+    config = load_config()
+    if with_confidence:
+        config["confidence"] = {"below": 0.5, "level": "URGENT", "reason": "The model is unsure."}
+    rules = compile_rules(config, "a" * 64)
+    cases = random_cases(rules, 500)
+    assert triage_batch(cases, rules) == [triage(rules=rules, **c) for c in cases]
+
+
+def test_batch_matches_with_duplicate_reasons_and_cap():
+    config = load_config()
+    # Every rule shares its text with another one, and the confidence reason repeats a rule's
+    config["rules"] = config["rules"] + copy.deepcopy(config["rules"])
+    config["confidence"] = {"below": 0.9, "level": "CLINIC", "reason": config["rules"][0]["reason"]}
+    rules = compile_rules(config)
+    cases = random_cases(rules, 500, seed=1)
+    for c in cases[:50]:
+        c["answers"] = {k: True for k in rules.answer_keys}
+    results = triage_batch(cases, rules)
+    assert results == [triage(rules=rules, **c) for c in cases]
+    assert max(len(r.reason_ids) for r in results) == MAX_REASONS
+
+
+def test_batch_uses_precomputed_flags():
+    rules = compile_rules(load_config())
+    flags = {f: f == "chest_pain" for f in rules.keywords}
+    case = {"symptom_text": "", "age": 30, "sex": "male", "pregnant": False, "answers": {}, "flags": flags}
+    assert triage_batch([case], rules) == [triage(rules=rules, **case)]
+    assert triage_batch([], rules) == []
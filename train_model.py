@@ -1,51 +1,346 @@
+import argparse
+import io
 import os
-import pandas as pd
-from sklearn.model_selection import train_test_split
+import re
+import shutil
+import time
+import numpy as np
+from sklearn.model_selection import GroupKFold, train_test_split
 from sklearn.metrics import accuracy_score
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.naive_bayes import BernoulliNB
+from sklearn.tree import DecisionTreeClassifier
 import joblib
 
+from case_log import CASE_LOG_PATH, read_since, records_to_matrix
+from dataset import file_sha256, load_matrix
+from inference import HammingPrototypeClassifier, calibrate, compile_engine, engine_from_payload
+
 DATA_PATH = os.path.join("data", "Training.csv")
+TEST_PATH = os.path.join("data", "Testing.csv")
 MODEL_PATH = "model.joblib"
+MODELS_DIR = "models"           # every saved version, model-v0001.joblib, ...
+KEEP_VERSIONS = 5
+# Parallelism is for fitting only; the deployed model predicts one row at a time
+TRAIN_N_JOBS = -1
+PREDICT_N_JOBS = 1
 
-def main():
-    df = pd.read_csv(DATA_PATH)
+# Incremental forest updates: trees added per run, and Training.csv rows per
+# class mixed into their training data so every tree knows every class
+FOREST_INCREMENT = 30
+REPLAY_PER_CLASS = 5
+
+# Temperatures tried when calibrating the model's probabilities on held-out cases,
+# scored by cross-validation over the unique training symptom patterns
+TEMPERATURES = np.geomspace(0.1, 10.0, 81)
+CALIBRATION_FOLDS = 5
+
+# Candidates for --select, from the current 300-tree forest down to a single tree
+# and a few-KB bit-packed prototype table (pass --candidates hamming_prototypes
+# to force it)
+CANDIDATES = {
+    "forest_300": lambda: RandomForestClassifier(n_estimators=300, random_state=42, n_jobs=TRAIN_N_JOBS),
+    "forest_100": lambda: RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=TRAIN_N_JOBS),
+    "forest_30": lambda: RandomForestClassifier(n_estimators=30, random_state=42, n_jobs=TRAIN_N_JOBS),
+    "forest_10": lambda: RandomForestClassifier(n_estimators=10, random_state=42, n_jobs=TRAIN_N_JOBS),
+    "decision_tree": lambda: DecisionTreeClassifier(random_state=42),
+    "bernoulli_nb": lambda: BernoulliNB(),
+    "hamming_prototypes": lambda: HammingPrototypeClassifier(),
+}
+
+
+# -----------------------------
+# Training data + versioned artifacts
+# -----------------------------
+def training_data(log_path: str = CASE_LOG_PATH):
+    # Training.csv plus every confirmed case logged so far -> (X, y, columns, log offset)
+    # uint8 matrix memory-mapped from data/cache (re-parsed only when the CSV changes)
+    ds = load_matrix(DATA_PATH)
+    records, offset = read_since(log_path, 0)
+    if not records:
+        return ds.X, ds.labels(), ds.feature_columns, offset
+    X_log, y_log = records_to_matrix(records, ds.feature_columns)
+    return np.vstack([ds.X, X_log]), np.concatenate([ds.labels(), y_log]), ds.feature_columns, offset
+
+
+def held_out_proba(make_model, X, y, feature_columns, folds: int = CALIBRATION_FOLDS):
+    # Out-of-fold probabilities for every unique (symptom pattern, diagnosis) row
+    # -> (proba over np.unique(y), true class index). Training.csv repeats each
+    # pattern many times, so rows are de-duplicated and the folds split by pattern:
+    # no pattern is scored by a model that has seen it.
+    classes, y_idx = np.unique(np.asarray(y).astype(str), return_inverse=True)
+    rows = np.unique(np.column_stack([np.asarray(X, dtype=np.int64), y_idx]), axis=0)
+    X_u, y_u = rows[:, :-1].astype(np.uint8), rows[:, -1]
+    groups = np.unique(X_u, axis=0, return_inverse=True)[1].ravel()
+    proba = np.zeros((len(X_u), len(classes)))
+    for train, test in GroupKFold(n_splits=min(folds, int(groups.max()) + 1)).split(X_u, y_u, groups):
+        model = make_model()
+        model.fit(X_u[train], classes[y_u[train]])
+        engine = engine_from_payload({"model": model, "feature_columns": list(feature_columns)})
+        cols = np.searchsorted(classes, engine.classes_.astype(str))
+        proba[np.ix_(test, cols)] = engine.predict_proba_batch(X_u[test])
+    return proba, y_u
+
+
+def fit_temperature(proba: np.ndarray, y_idx: np.ndarray) -> float:
+    # Temperature scaling: the T minimising the held-out negative log-likelihood
+    # (1.0 leaves the probabilities as they are)
+    rows = np.arange(len(y_idx))
+    nll = [-np.log(np.maximum(calibrate(proba, t)[rows, y_idx], 1e-12)).mean() for t in TEMPERATURES]
+    return float(TEMPERATURES[int(np.argmin(nll))])
+
+
+def calibrate_payload(payload, make_model, X, y) -> float:
+    # Stored with the model; incremental updates keep it until the next full training run
+    proba, y_idx = held_out_proba(make_model, X, y, payload["feature_columns"])
+    temperature = fit_temperature(proba, y_idx)
+    if temperature in (TEMPERATURES[0], TEMPERATURES[-1]):
+        # The optimum is off the grid (e.g. every held-out pattern classified right),
+        # so the held-out rows cannot pin T down; extrapolating would be guesswork
+        print(f"⚠️ Calibration temperature hit the edge of the search grid ({temperature:.3g}); "
+              f"keeping uncalibrated probabilities (T=1)")
+        temperature = 1.0
+    payload["calibration"] = {
+        "temperature": temperature,
+        "held_out_rows": int(len(y_idx)),
+        "folds": CALIBRATION_FOLDS,
+    }
+    return temperature
+
+
+def _saved_versions():
+    if not os.path.isdir(MODELS_DIR):
+        return []
+    found = (re.fullmatch(r"model-v(\d+)\.joblib", name) for name in os.listdir(MODELS_DIR))
+    return sorted(int(m.group(1)) for m in found if m)
+
+
+def save_payload(payload, log_offset: int) -> int:
+    versions = _saved_versions()
+    version = (versions[-1] if versions else 0) + 1
+    payload["training_state"] = {
+        "version": version,
+        "log_offset": int(log_offset),   # bytes of the case log already learned from
+        "trained_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+    }
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    versioned = os.path.join(MODELS_DIR, f"model-v{version:04d}.joblib")
+    joblib.dump(payload, versioned + ".tmp")
+    os.replace(versioned + ".tmp", versioned)
 
-    # Many versions of this dataset include an extra unnamed column at the end
-    df = df.loc[:, ~df.columns.str.contains("^Unnamed")]
+    # Swap the deployed artifact: a process loading MODEL_PATH sees either the
+    # previous version or this one, never a partially written file
+    shutil.copyfile(versioned, MODEL_PATH + ".tmp")
+    os.replace(MODEL_PATH + ".tmp", MODEL_PATH)
 
-    target_col = "prognosis"  # common label name in this dataset
-    if target_col not in df.columns:
-        raise ValueError(f"Expected target column '{target_col}' not found. Columns: {df.columns.tolist()[:10]}...")
+    # Pre-build the memory-mapped copy, so the next app start skips unpickling
+    try:
+        compile_engine(engine_from_payload(payload), MODEL_PATH, file_sha256(MODEL_PATH))
+    except OSError as exc:
+        print(f"⚠️ Could not pre-build the memory-mapped model: {exc}")
 
-    X = df.drop(columns=[target_col])
-    y = df[target_col]
+    # Keep the newest KEEP_VERSIONS (this one included) for rollback
+    for old in versions[:max(0, len(versions) - (KEEP_VERSIONS - 1))]:
+        os.remove(os.path.join(MODELS_DIR, f"model-v{old:04d}.joblib"))
+    return version
 
-    # Train/validation split for quick sanity check
+
+def train_default(log_path: str = CASE_LOG_PATH):
+    X, y, feature_columns, log_offset = training_data(log_path)
+
+    # Train/validation split for quick sanity check (diagnoses seen only once
+    # in the case log cannot be stratified)
+    _, class_counts = np.unique(y, return_counts=True)
     X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
+        X, y, test_size=0.2, random_state=42, stratify=y if class_counts.min() >= 2 else None
     )
 
     model = RandomForestClassifier(
         n_estimators=300,
         random_state=42,
-        n_jobs=-1
+        n_jobs=TRAIN_N_JOBS
     )
     model.fit(X_train, y_train)
 
     preds = model.predict(X_val)
     acc = accuracy_score(y_val, preds)
 
+    model.set_params(n_jobs=PREDICT_N_JOBS)
+
     # Save model + feature columns (VERY IMPORTANT for deployment)
     payload = {
         "model": model,
-        "feature_columns": list(X.columns)
+        "feature_columns": list(feature_columns)
     }
-    joblib.dump(payload, MODEL_PATH)
+    temperature = calibrate_payload(payload, CANDIDATES["forest_300"], X, y)
+    version = save_payload(payload, log_offset)
 
-    print(f"✅ Trained model saved to {MODEL_PATH}")
+    print(f"✅ Trained model saved to {MODEL_PATH} (version {version})")
     print(f"✅ Validation accuracy (quick check): {acc:.3f}")
-    print(f"✅ Features: {len(X.columns)}")
+    print(f"✅ Probability calibration temperature: {temperature:.3g} "
+          f"({CALIBRATION_FOLDS}-fold CV over unique training patterns)")
+    print(f"✅ Features: {len(feature_columns)}")
+
+
+def profile_model(model, feature_columns, X_test, y_test, batch_rows: int = 1000):
+    # Measured through the same engine the app and server load, not sklearn's predict
+    payload = {"model": model, "feature_columns": list(feature_columns)}
+    buf = io.BytesIO()
+    joblib.dump(payload, buf)
+    blob = buf.getvalue()
+
+    t0 = time.perf_counter()
+    engine = engine_from_payload(joblib.load(io.BytesIO(blob)))
+    load_s = time.perf_counter() - t0
+
+    acc = float(np.mean(engine.predict_batch(X_test) == y_test))
+
+    rows = [np.flatnonzero(r).tolist() for r in X_test]
+    engine.predict(rows[0])  # warm-up
+    lat = []
+    for r in rows:
+        t0 = time.perf_counter()
+        engine.predict(r)
+        lat.append(time.perf_counter() - t0)
+
+    X_batch = np.resize(np.asarray(X_test, dtype=np.float64), (batch_rows, X_test.shape[1]))
+    t0 = time.perf_counter()
+    engine.predict_batch(X_batch)
+    batch_s = time.perf_counter() - t0
+
+    return {
+        "accuracy": acc,
+        "size_kb": len(blob) / 1024.0,
+        "load_ms": load_s * 1000.0,
+        "single_us": float(np.median(lat)) * 1e6,
+        "batch_us_per_row": batch_s / batch_rows * 1e6,
+        "payload": payload,
+    }
+
+
+def select_model(tolerance: float, objective: str, candidates=None, log_path: str = CASE_LOG_PATH):
+    X_train, y_train, feature_columns, log_offset = training_data(log_path)
+    test = load_matrix(TEST_PATH)
+    # Testing.csv is held out entirely, so candidates fit on all of Training.csv (+ case log)
+    y_test = test.labels()
+    if list(test.feature_columns) != list(feature_columns):
+        raise ValueError("Training.csv and Testing.csv have different feature columns.")
+
+    results = {}
+    for name in candidates or CANDIDATES:
+        model = CANDIDATES[name]()
+        model.fit(X_train, y_train)
+        if "n_jobs" in model.get_params():
+            model.set_params(n_jobs=PREDICT_N_JOBS)
+        results[name] = profile_model(model, feature_columns, test.X, y_test)
+
+    print(f"{'model':<20}{'accuracy':>10}{'size KB':>10}{'load ms':>10}{'1-row µs':>10}{'batch µs/row':>14}")
+    for name, r in results.items():
+        print(f"{name:<20}{r['accuracy']:>10.3f}{r['size_kb']:>10.0f}{r['load_ms']:>10.1f}"
+              f"{r['single_us']:>10.0f}{r['batch_us_per_row']:>14.1f}")
+
+    best_acc = max(r["accuracy"] for r in results.values())
+    eligible = {n: r for n, r in results.items() if r["accuracy"] >= best_acc - tolerance}
+    key = "size_kb" if objective == "size" else "single_us"
+    chosen = min(eligible, key=lambda n: eligible[n][key])
+
+    payload = results[chosen]["payload"]
+    # Calibrated on the training patterns: Testing.csv (one row per class) has
+    # already been used to pick the model
+    temperature = calibrate_payload(payload, CANDIDATES[chosen], X_train, y_train)
+    version = save_payload(payload, log_offset)
+    print(f"✅ Selected {chosen} (smallest {'size' if objective == 'size' else 'latency'} within "
+          f"{tolerance:.3f} of best accuracy {best_acc:.3f}); saved to {MODEL_PATH} (version {version})")
+    print(f"✅ Probability calibration temperature: {temperature:.3g} "
+          f"({CALIBRATION_FOLDS}-fold CV over unique training patterns)")
+    return chosen, results
+
+
+# -----------------------------
+# Incremental retraining from the case log
+# -----------------------------
+def update_model(model, X_new, y_new, feature_columns, log_path: str = CASE_LOG_PATH, log_offset: int = 0):
+    known = {str(c) for c in getattr(model, "classes_", ())}
+    new_classes = sorted({str(c) for c in y_new} - known)
+    if isinstance(model, HammingPrototypeClassifier):
+        return model.partial_fit(X_new, y_new)
+    if new_classes:
+        raise ValueError(f"new diagnoses {new_classes[:5]} need a full retrain (python train_model.py)")
+
+    if isinstance(model, RandomForestClassifier):
+        # Added trees see the new cases plus a few Training.csv rows of every class
+        ds = load_matrix(DATA_PATH)
+        labels = ds.labels()
+        rng = np.random.default_rng(len(model.estimators_))
+        replay = np.concatenate([
+            rng.choice(np.flatnonzero(labels == c), size=min(REPLAY_PER_CLASS, int((labels == c).sum())),
+                       replace=False)
+            for c in np.unique(labels)
+        ])
+        X = np.vstack([ds.X[np.sort(replay)], X_new])
+        y = np.concatenate([labels[np.sort(replay)], y_new])
+        missing = known - set(map(str, np.unique(y)))
+        if missing:
+            # Diagnoses only the already-learned part of the log has: replay those rows too
+            old, _ = read_since(log_path, 0, until=log_offset)
+            old = [r for r in old if str(r["diagnosis"]).strip() in missing]
+            if {str(r["diagnosis"]).strip() for r in old} != missing:
+                raise ValueError(f"no training rows left for {sorted(missing)[:5]}; run a full retrain")
+            X_old, y_old = records_to_matrix(old, feature_columns)
+            X, y = np.vstack([X, X_old]), np.concatenate([y, y_old])
+        model.set_params(warm_start=True, n_estimators=len(model.estimators_) + FOREST_INCREMENT,
+                         n_jobs=TRAIN_N_JOBS)
+        model.fit(X, y)
+        model.set_params(warm_start=False, n_jobs=PREDICT_N_JOBS)
+        return model
+
+    if hasattr(model, "partial_fit"):  # e.g. BernoulliNB: exact count updates
+        return model.partial_fit(X_new, y_new)
+    raise ValueError(f"{type(model).__name__} cannot be updated incrementally; run a full retrain")
+
+
+def train_incremental(log_path: str = CASE_LOG_PATH):
+    # Learns only from records appended since the checkpoint stored in the model itself
+    payload = joblib.load(MODEL_PATH)
+    state = payload.get("training_state") or {}
+    offset = int(state.get("log_offset", 0))
+    records, end = read_since(log_path, offset)
+    if not records:
+        print(f"✅ No new confirmed cases in {log_path} since byte {offset}; {MODEL_PATH} unchanged")
+        return None
+
+    t0 = time.perf_counter()
+    X_new, y_new = records_to_matrix(records, payload["feature_columns"])
+    payload["model"] = update_model(payload["model"], X_new, y_new, payload["feature_columns"], log_path, offset)
+    version = save_payload(payload, end)
+    print(f"✅ Learned {len(records)} new confirmed cases in {time.perf_counter() - t0:.1f}s; "
+          f"saved to {MODEL_PATH} (version {version}, log offset {end})")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the HealthMate symptom classifier")
+    parser.add_argument("--select", action="store_true",
+                        help="fit several model families and keep the smallest/fastest one within tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.01,
+                        help="accepted accuracy drop vs the best candidate on Testing.csv")
+    parser.add_argument("--objective", choices=["size", "latency"], default="latency")
+    parser.add_argument("--candidates", nargs="+", choices=list(CANDIDATES))
+    parser.add_argument("--incremental", action="store_true",
+                        help="update the saved model with cases appended to the case log since its checkpoint")
+    parser.add_argument("--log", default=CASE_LOG_PATH, help="confirmed-case log (see case_log.py)")
+    args = parser.parse_args()
+
+    try:
+        if args.incremental:
+            train_incremental(args.log)
+        elif args.select:
+            select_model(args.tolerance, args.objective, args.candidates, args.log)
+        else:
+            train_default(args.log)
+    except ValueError as exc:
+        raise SystemExit(f"❌ {exc}")
+
 
 if __name__ == "__main__":
     main()
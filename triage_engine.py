@@ -1,143 +1,314 @@
-from dataclasses import dataclass
-from typing import Dict, List, Tuple
-@dataclass
-class TriageResult:
-    level: str                  # "SELF_CARE" | "CLINIC" | "URGENT"
-    title: str                  # user-friendly label
-    reasons: List[str]          # why this triage level
-    advice: List[str]           # what to do next
-    disclaimers: List[str]      # safety text
-    suggested_facilities: List[str]  # placeholders for demo
-
-
-# Simple NLP-ish keyword detection (MVP-friendly)
-KEYWORDS = {
-    "fever": ["fever", "hot", "temperature", "high temp", "burning"],
-    "cough": ["cough", "coughing"],
-    "chest_pain": ["chest pain", "tightness", "pressure in chest", "pain in chest"],
-    "sob": ["shortness of breath", "can't breathe", "breathless", "difficulty breathing", "sob"],
-    "abd_pain": ["abdominal pain", "stomach pain", "tummy pain", "belly pain"],
-    "vomiting": ["vomit", "vomiting", "throwing up"],
-    "diarrhea": ["diarrhea", "loose stool", "watery stool"],
-    "headache": ["headache", "migraine", "head pain"],
-    "pregnant": ["pregnant", "pregnancy"],
-    "bleeding": ["bleeding", "blood in stool", "vomiting blood", "coughing blood"],
-    "fainting": ["faint", "collapsed", "passed out", "syncope"],
-    "confusion": ["confused", "confusion", "drowsy", "not responding"],
-    "severe_pain": ["severe", "worst", "unbearable"],
-}
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
 
+import numpy as np
 
-def detect_flags(symptom_text: str) -> Dict[str, bool]:
-    text = (symptom_text or "").lower().strip()
-    flags = {k: False for k in KEYWORDS.keys()}
-    for flag, words in KEYWORDS.items():
-        for w in words:
-            if w in text:
-                flags[flag] = True
-                break
+from facilities import check_location, format_referral, load_facilities
+from metrics import inc, timed
+from symptom_matcher import SymptomMatcher
+from triage_rules import LEVEL_ORDER, RuleSet, current_rules, reasons_for_version
+
+# Immutable and slotted: a result only holds IDs into shared templates (the
+# level's title/advice, the rule set's reason texts, rows of the facility
+# file) and expands them to text on access, so nothing is copied per call.
+class TriageResult(NamedTuple):
+    level: str                                      # "SELF_CARE" | "CLINIC" | "URGENT"
+    reason_ids: Tuple[int, ...] = ()                # indices into the rule set's reasons
+    rule_version: str = ""                          # version of the rules file that produced it
+    referrals: Tuple[Tuple[int, float], ...] = ()   # (facility row, km) nearest first
+    score: Optional[int] = None                     # total weight of the fired rules (not in short codes)
+
+    @property
+    def title(self) -> str:                         # user-friendly label
+        return LEVELS[self.level][0]
+
+    @property
+    def reasons(self) -> Tuple[str, ...]:           # why this triage level
+        if not self.reason_ids:
+            return DEFAULT_REASONS
+        table = reasons_for_version(self.rule_version)
+        return tuple(table[i] for i in self.reason_ids)
+
+    @property
+    def advice(self) -> Tuple[str, ...]:            # what to do next
+        return LEVELS[self.level][1]
+
+    @property
+    def disclaimers(self) -> Tuple[str, ...]:       # safety text
+        return DISCLAIMERS
+
+    @property
+    def suggested_facilities(self) -> Tuple[str, ...]:  # placeholders without a location
+        if not self.referrals:
+            return SUGGESTED_FACILITIES
+        facilities = load_facilities().facilities
+        return tuple(format_referral(facilities[row], km) for row, km in self.referrals)
+
+    def as_dict(self) -> Dict[str, Any]:
+        # Expanded, JSON-friendly view (the server's response body)
+        return {
+            "level": self.level,
+            "title": self.title,
+            "reasons": list(self.reasons),
+            "advice": list(self.advice),
+            "disclaimers": list(self.disclaimers),
+            "suggested_facilities": list(self.suggested_facilities),
+            "rule_version": self.rule_version,
+        }
+
+
+# Keywords, risk rules and thresholds live in data/triage_rules.json (see
+# triage_rules.py) and are reloaded while running when that file changes.
+# Each call picks up the current RuleSet once and uses it throughout, so
+# callers that scan and triage separately can pass the same `rules` to both.
+def get_matcher(feature_columns: Tuple[str, ...] = (), language: Optional[str] = None,
+                rules: Optional[RuleSet] = None) -> SymptomMatcher:
+    return (rules or current_rules()).matcher(feature_columns, language)
+
+
+def detect_flags(symptom_text: str, language: Optional[str] = None,
+                 rules: Optional[RuleSet] = None) -> Dict[str, bool]:
+    with timed("detect_flags"):
+        flags, _ = get_matcher((), language, rules).scan(symptom_text)
     return flags
 
 
-def risk_score(flags: Dict[str, bool], answers: Dict[str, bool], age: int, pregnant: bool) -> Tuple[int, List[str]]:
-    score = 0
-    reasons = []
-
-    # Red flags (high risk)
-    if answers.get("difficulty_breathing"):
-        score += 5; reasons.append("You reported difficulty breathing.")
-    if answers.get("chest_pain_now") or flags.get("chest_pain"):
-        score += 5; reasons.append("Chest pain/tightness can be serious.")
-    if answers.get("confusion") or flags.get("confusion"):
-        score += 5; reasons.append("Confusion/drowsiness is a danger sign.")
-    if answers.get("fainting") or flags.get("fainting"):
-        score += 5; reasons.append("Fainting/collapse is a danger sign.")
-    if answers.get("bleeding") or flags.get("bleeding"):
-        score += 5; reasons.append("Bleeding can be an emergency.")
-
-    # Fever-related
-    if answers.get("fever_high") or flags.get("fever"):
-        score += 2; reasons.append("Fever may suggest an infection.")
-    if answers.get("fever_days_3plus"):
-        score += 2; reasons.append("Fever lasting ≥ 3 days needs review.")
-    if answers.get("severe_headache") and flags.get("headache"):
-        score += 3; reasons.append("Severe headache with fever can be serious.")
-
-    # GI-related
-    if flags.get("vomiting") or answers.get("persistent_vomiting"):
-        score += 2; reasons.append("Persistent vomiting increases dehydration risk.")
-    if flags.get("diarrhea") or answers.get("diarrhea_many"):
-        score += 2; reasons.append("Frequent diarrhea can cause dehydration.")
-    if answers.get("unable_to_drink"):
-        score += 4; reasons.append("Unable to drink/keep fluids down is a danger sign.")
-
-    # Vulnerable groups
+MAX_AGE = 130
+
+
+def parse_age(value: Any) -> int:
+    # Whole years from a number or numeric string (fractions are dropped, 0.5 -> 0);
+    # raises ValueError unless it is a finite age between 0 and MAX_AGE
+    if isinstance(value, bool):
+        raise ValueError("age must be a number of years")
+    try:
+        age = float(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError("age must be a number of years") from None
+    if not 0 <= age <= MAX_AGE:  # also rejects inf and nan
+        raise ValueError(f"age must be between 0 and {MAX_AGE}")
+    return int(age)
+
+
+def _active_signals(flags: Dict[str, bool], answers: Dict[str, bool], age: int, pregnant: bool) -> set:
+    active = {"answer:" + k for k, v in answers.items() if v}
+    active.update("flag:" + k for k, v in flags.items() if v)
     if age >= 65:
-        score += 2; reasons.append("Older adults are at higher risk of complications.")
+        active.add("age_65_plus")
     if age <= 5:
-        score += 2; reasons.append("Young children are at higher risk of complications.")
+        active.add("age_5_under")
     if pregnant:
-        score += 2; reasons.append("Pregnancy requires a lower threshold to seek care.")
+        active.add("pregnant")
+    return active
+
+
+def _score(flags: Dict[str, bool], answers: Dict[str, bool], age: int, pregnant: bool,
+           rules: RuleSet) -> Tuple[int, List[int]]:
+    # -> (score, indices of the rules that fired)
+    with timed("risk_score"):
+        fired = rules.fired(_active_signals(flags, answers, age, pregnant))
+        score = sum(rules.rules[i].weight for i in fired)
+    return score, fired
 
-    return score, reasons
 
+def risk_score(flags: Dict[str, bool], answers: Dict[str, bool], age: int, pregnant: bool,
+               rules: Optional[RuleSet] = None) -> Tuple[int, List[str]]:
+    rules = rules or current_rules()
+    score, fired = _score(flags, answers, age, pregnant, rules)
+    return score, [rules.reasons[i] for i in fired]
 
-def triage(symptom_text: str, age: int, sex: str, pregnant: bool, answers: Dict[str, bool]) -> TriageResult:
-    flags = detect_flags(symptom_text)
-    score, reasons = risk_score(flags, answers, age, pregnant)
 
-    # Determine level
-    if score >= 8:
-        level = "URGENT"
-        title = "Seek urgent care now"
-        advice = [
+LEVELS = {
+    "URGENT": (
+        "Seek urgent care now",
+        (
             "Go to the nearest health facility or emergency unit now.",
             "If available, call a trusted person to accompany you.",
             "If symptoms worsen (breathing, chest pain, confusion), seek help immediately."
-        ]
-    elif score >= 4:
-        level = "CLINIC"
-        title = "See a clinician within 24–48 hours"
-        advice = [
+        ),
+    ),
+    "CLINIC": (
+        "See a clinician within 24–48 hours",
+        (
             "Visit a clinic/health center within the next 1–2 days for assessment.",
             "Continue monitoring symptoms. If new danger signs appear, seek urgent care.",
             "Stay hydrated and rest. Avoid self-medicating with antibiotics."
-        ]
-    else:
-        level = "SELF_CARE"
-        title = "Home care + monitoring"
-        advice = [
+        ),
+    ),
+    "SELF_CARE": (
+        "Home care + monitoring",
+        (
             "Rest, drink plenty of fluids, and monitor symptoms.",
             "Use simple supportive care (e.g., oral rehydration for diarrhea).",
             "If symptoms persist >48 hours or worsen, visit a clinic."
-        ]
-
-    disclaimers = [
-        "HealthMate AI provides general guidance and triage support — not a medical diagnosis.",
-        "If you feel severely unwell or unsafe, seek care immediately regardless of this result.",
-        "For children, pregnancy, or chronic illness, seek care sooner when unsure."
-    ]
-
-    # Demo facility suggestions (placeholders)
-    suggested_facilities = [
-        "Nearest Health Centre III / IV",
-        "Katabi Military Hospital",
-        "District Hospital",
-        "Regional Referral Hospital",
-        "Grade B Entebbe Regional Referral Hospital",
-        "Dr Bata StateHouse Hospital",
-        "Emmanuel Hospital Entebbe",
-        "Mulago National Referral Hospital (demo example)"
-    ]
-
-    # Keep reasons concise for demo
-    reasons = list(dict.fromkeys(reasons))[:6]  # de-duplicate and cap
-
-    return TriageResult(
-        level=level,
-        title=title,
-        reasons=reasons if reasons else ["Based on the information provided."],
-        advice=advice,
-        disclaimers=disclaimers,
-        suggested_facilities=suggested_facilities
-    )
+        ),
+    ),
+}
+
+DISCLAIMERS = (
+    "HealthMate AI provides general guidance and triage support — not a medical diagnosis.",
+    "If you feel severely unwell or unsafe, seek care immediately regardless of this result.",
+    "For children, pregnancy, or chronic illness, seek care sooner when unsure."
+)
+
+DEFAULT_REASONS = ("Based on the information provided.",)
+MAX_REASONS = 6
+
+# Shown when the caller gives no location (see facilities.py for referrals)
+SUGGESTED_FACILITIES = (
+    "Nearest Health Centre III / IV",
+    "Katabi Military Hospital",
+    "District Hospital",
+    "Regional Referral Hospital",
+    "Grade B Entebbe Regional Referral Hospital",
+    "Dr Bata StateHouse Hospital",
+    "Emmanuel Hospital Entebbe",
+    "Mulago National Referral Hospital (demo example)"
+)
+
+
+def level_for_score(score: int, rules: Optional[RuleSet] = None) -> str:
+    return (rules or current_rules()).level_for_score(score)
+
+
+def _build_result(level: str, fired: Sequence[int], rules: RuleSet,
+                  referrals: Tuple[Tuple[int, float], ...] = (), score: Optional[int] = None) -> TriageResult:
+    # Keep reasons concise for demo: de-duplicate (by text) and cap
+    ids, seen = [], set()
+    for i in fired:
+        reason = rules.reasons[i]
+        if reason not in seen:
+            seen.add(reason)
+            ids.append(int(i))
+            if len(ids) == MAX_REASONS:
+                break
+    return TriageResult(level, tuple(ids), rules.version, referrals, score)
+
+
+def _referrals(found) -> Tuple[Tuple[int, float], ...]:
+    # Distances are kept to 0.1 km, the precision shown and sent in short codes
+    return tuple((f.row, round(km, 1)) for f, km in found)
+
+
+def triage(symptom_text: str, age: int, sex: str, pregnant: bool, answers: Dict[str, bool],
+           flags: Optional[Dict[str, bool]] = None, language: Optional[str] = None,
+           rules: Optional[RuleSet] = None, location: Optional[Tuple[float, float]] = None,
+           confidence: Optional[float] = None) -> TriageResult:
+    # location: (lat, lon) in degrees; with it, referrals are the nearest facilities for the level.
+    # confidence: the model's top calibrated probability; raises the level when the
+    # rules file has a "confidence" section and the model is unsure.
+    rules = rules or current_rules()
+    # Callers that already scanned the text (e.g. for model features) can pass the flags in
+    if flags is None:
+        flags = detect_flags(symptom_text, language, rules)
+    score, fired = _score(flags, answers, age, pregnant, rules)
+    level = rules.level_for_score(score)
+    if rules.escalates(level, confidence):
+        level = rules.confidence.level
+        fired = fired + [rules.confidence_reason_id]  # highest ID, so SMS codes round-trip
+        inc("healthmate_confidence_escalations_total", help="Triage levels raised by low model confidence.")
+    inc("healthmate_triage_level_total", help="Triage results by level.", level=level)
+    referrals = ()
+    if location is not None:
+        lat, lon = location
+        referrals = _referrals(load_facilities().nearest(lat, lon, level))
+    return _build_result(level, fired, rules, referrals, score)
+
+
+# -----------------------------
+# Batch triage (nightly district backlogs)
+# -----------------------------
+def triage_batch(cases: Iterable[Dict[str, Any]], rules: Optional[RuleSet] = None) -> List[TriageResult]:
+    # Each case holds the keyword arguments of triage(): symptom_text, age, sex,
+    # pregnant, answers and optionally pre-computed flags, a language code, a
+    # (lat, lon) location or the model's confidence.
+    cases = list(cases)
+    rules = rules or current_rules()
+    n = len(cases)
+    flag_col, answer_col = rules.flag_columns, rules.answer_columns
+    col = rules.signal_index
+    pregnant_col = col.get("pregnant")
+
+    # Active signals as (case, signal) coordinates, written into the cases x
+    # signals matrix in one go
+    rows: List[int] = []
+    cols: List[int] = []
+    ages = []
+    for i, case in enumerate(cases):
+        flags = case.get("flags")
+        if flags is None:
+            flags = detect_flags(case.get("symptom_text", ""), case.get("language"), rules)
+        active = [flag_col[k] for k, v in flags.items() if v and k in flag_col]
+        answers = case.get("answers")
+        if answers:
+            active += [answer_col[k] for k, v in answers.items() if v and k in answer_col]
+        if pregnant_col is not None and case.get("pregnant"):
+            active.append(pregnant_col)
+        if active:
+            rows += [i] * len(active)
+            cols += active
+        ages.append(int(case.get("age", 0)))
+    S = np.zeros((n, len(rules.signals)), dtype=np.int32)
+    S[np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)] = 1
+    ages = np.array(ages, dtype=np.int64)
+    if "age_65_plus" in col:
+        S[:, col["age_65_plus"]] = ages >= 65
+    if "age_5_under" in col:
+        S[:, col["age_5_under"]] = ages <= 5
+
+    # cases x rules: any-of rules need one signal, all-of rules need every signal
+    all_m = rules.all_matrix
+    hits = np.where(rules.is_all, (S @ all_m) == all_m.sum(axis=0), (S @ rules.any_matrix) > 0)
+    scores = hits.astype(np.int32) @ rules.weights
+    level_idx = np.where(scores >= rules.urgent_score, 2, np.where(scores >= rules.clinic_score, 1, 0))
+
+    escalated = np.zeros(len(cases), dtype=bool)
+    if rules.confidence is not None:
+        conf = np.array([c["confidence"] if c.get("confidence") is not None else np.inf for c in cases],
+                        dtype=np.float64)
+        target = LEVEL_ORDER.index(rules.confidence.level)
+        escalated = (conf < rules.confidence.below) & (level_idx < target)
+        level_idx = np.where(escalated, target, level_idx)
+        if escalated.any():
+            inc("healthmate_confidence_escalations_total", int(escalated.sum()),
+                help="Triage levels raised by low model confidence.")
+
+    level_names = LEVEL_ORDER
+    for name, n in zip(level_names, np.bincount(level_idx, minlength=3)):
+        if n:
+            inc("healthmate_triage_level_total", int(n), help="Triage results by level.", level=name)
+
+    # Referrals: one k-nearest query per triage level for every located case
+    referrals: List[Tuple[Tuple[int, float], ...]] = [()] * len(cases)
+    located = [i for i, case in enumerate(cases) if case.get("location") is not None]
+    if located:
+        index = load_facilities()
+        points = np.array([cases[i]["location"] for i in located], dtype=np.float64).reshape(-1, 2)
+        for lat, lon in points:
+            check_location(lat, lon)
+        levels = level_idx[located]
+        for li, name in enumerate(level_names):
+            rows = np.flatnonzero(levels == li)
+            if len(rows):
+                for r, found in zip(rows, index.nearest_batch(points[rows], name)):
+                    referrals[located[r]] = _referrals(found)
+
+    # Reason IDs exactly as _build_result picks them: the first fired rule per
+    # reason text, at most MAX_REASONS, then the confidence reason (ID len(rules))
+    keep = hits & ((hits.astype(np.int32) @ rules.shadow_matrix) == 0)
+    keep &= np.cumsum(keep, axis=1) <= MAX_REASONS
+    if escalated.any():
+        add = escalated & ~(keep & rules.confidence_shadow).any(axis=1) & (keep.sum(axis=1) < MAX_REASONS)
+        keep = np.column_stack([keep, add])
+    case_of, reason_ids = np.nonzero(keep)
+    reason_ids = reason_ids.tolist()
+    ends = np.cumsum(np.bincount(case_of, minlength=n)).tolist()
+
+    version = rules.version
+    levels = [level_names[j] for j in level_idx.tolist()]
+    scores = scores.tolist()
+    results = []
+    start = 0
+    for i, end in enumerate(ends):
+        results.append(TriageResult(levels[i], tuple(reason_ids[start:end]), version, referrals[i], scores[i]))
+        start = end
+    return results
@@ -0,0 +1,352 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from local_lexicon import load_synonyms
+from metrics import add_collector, inc
+from symptom_matcher import SymptomMatcher, build_matcher
+
+# Override with HEALTHMATE_RULES=/path/to/rules.json
+RULES_PATH = os.environ.get(
+    "HEALTHMATE_RULES",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "triage_rules.json"),
+)
+RELOAD_CHECK_S = 2.0    # how often the rules file's mtime is checked
+
+# Signals that do not come from a keyword flag or a follow-up answer
+DEMOGRAPHIC_SIGNALS = ("age_65_plus", "age_5_under", "pregnant")
+RULE_FIELDS = {"group", "weight", "reason", "any_of", "all_of"}
+LEVEL_ORDER = ("SELF_CARE", "CLINIC", "URGENT")
+
+# The last MAX_VERSIONS rule versions loaded by this process, keyed by content
+# hash: (full version, reason texts). Results and decoded short codes refer to
+# reasons by index into these tables.
+MAX_VERSIONS = 32
+_VERSIONS: "OrderedDict[str, Tuple[str, Tuple[str, ...]]]" = OrderedDict()
+_versions_lock = threading.Lock()
+
+
+# Risk rules: a rule fires when ANY of `any_of` (or ALL of `all_of`) signals are set.
+# Signals are "answer:<key>", "flag:<key>", "age_65_plus", "age_5_under" and "pregnant".
+class Rule(NamedTuple):
+    weight: int
+    reason: str
+    any_of: Tuple[str, ...] = ()
+    all_of: Tuple[str, ...] = ()
+
+
+# Optional link from the model's confidence to the triage level: when the top
+# calibrated probability is below `below`, the level is raised to at least `level`
+class ConfidenceRule(NamedTuple):
+    below: float
+    level: str
+    reason: str
+
+
+# -----------------------------
+# Compiled, immutable rule set
+# -----------------------------
+# Everything a request needs is derived once here: the keyword matcher(s), a
+# signal -> rules index for per-request scoring and the matrices used by
+# triage_batch. A RuleSet is never mutated, so a request that picked one up
+# finishes on it even if a newer version is swapped in meanwhile.
+class RuleSet:
+    def __init__(self, version: str, keywords: Dict[str, List[str]], rules: List[Rule],
+                 urgent_score: int, clinic_score: int, confidence: Optional[ConfidenceRule] = None):
+        self.version = version
+        self.keywords = keywords
+        self.rules = rules
+        self.urgent_score = urgent_score
+        self.clinic_score = clinic_score
+        self.confidence = confidence
+        # The confidence reason, if any, follows the rules' reasons (same ID space)
+        self.reasons = tuple(r.reason for r in rules) + ((confidence.reason,) if confidence else ())
+        self.confidence_reason_id = len(rules) if confidence else None
+        _register_version(version, self.reasons)
+
+        # Follow-up question keys the rules understand (the app's checkboxes)
+        self.answer_keys = list(dict.fromkeys(
+            s[len("answer:"):] for r in rules for s in r.any_of + r.all_of if s.startswith("answer:")
+        ))
+
+        # Per-request evaluator: only the rules touched by an active signal are visited
+        any_index: Dict[str, List[int]] = {}
+        self.all_of_rules: List[Tuple[int, FrozenSet[str]]] = []
+        for i, r in enumerate(rules):
+            if r.all_of:
+                self.all_of_rules.append((i, frozenset(r.all_of)))
+            else:
+                for s in r.any_of:
+                    any_index.setdefault(s, []).append(i)
+        self.any_index = {s: tuple(ix) for s, ix in any_index.items()}
+
+        # Batch evaluator: signals x rules incidence matrices
+        self.signals = list(dict.fromkeys(s for r in rules for s in r.any_of + r.all_of))
+        self.signal_index = {s: j for j, s in enumerate(self.signals)}
+        self.any_matrix = np.zeros((len(self.signals), len(rules)), dtype=np.int32)
+        self.all_matrix = np.zeros((len(self.signals), len(rules)), dtype=np.int32)
+        for i, r in enumerate(rules):
+            for s in r.any_of:
+                self.any_matrix[self.signal_index[s], i] = 1
+            for s in r.all_of:
+                self.all_matrix[self.signal_index[s], i] = 1
+        self.is_all = self.all_matrix.any(axis=0)
+        self.weights = np.array([r.weight for r in rules], dtype=np.int32)
+        self.flag_columns = {s[len("flag:"):]: j for s, j in self.signal_index.items() if s.startswith("flag:")}
+        self.answer_columns = {s[len("answer:"):]: j for s, j in self.signal_index.items() if s.startswith("answer:")}
+        # Reasons are de-duplicated by text: shadow_matrix[j, i] is set when an
+        # earlier rule j gives the same reason as rule i, and confidence_shadow
+        # marks the rules giving the confidence reason's text
+        texts = [r.reason for r in rules]
+        self.shadow_matrix = np.array(
+            [[j < i and texts[j] == texts[i] for i in range(len(rules))] for j in range(len(rules))], dtype=np.int32
+        )
+        self.confidence_shadow = np.array([confidence is not None and t == confidence.reason for t in texts])
+
+        self._matchers: Dict[Tuple[Tuple[str, ...], Optional[str]], SymptomMatcher] = {}
+        self._lock = threading.Lock()
+
+    def matcher(self, feature_columns: Tuple[str, ...] = (), language: Optional[str] = None) -> SymptomMatcher:
+        # Compiled once per (feature set, language) on first use and shared by every
+        # caller (app sessions included). English keywords are always matched too.
+        key = (tuple(feature_columns), language)
+        m = self._matchers.get(key)
+        if m is None:
+            synonyms = load_synonyms(language)  # ValueError for unknown languages
+            with self._lock:
+                m = self._matchers.get(key)
+                if m is None:
+                    m = build_matcher(self.keywords, key[0], synonyms)
+                    self._matchers[key] = m
+        return m
+
+    def fired(self, active: set) -> List[int]:
+        # Indices of the rules that fire for a set of active signals, in rule order
+        hits = set()
+        for s in active:
+            hits.update(self.any_index.get(s, ()))
+        for i, required in self.all_of_rules:
+            if required <= active:
+                hits.add(i)
+        return sorted(hits)
+
+    def level_for_score(self, score: int) -> str:
+        if score >= self.urgent_score:
+            return "URGENT"
+        if score >= self.clinic_score:
+            return "CLINIC"
+        return "SELF_CARE"
+
+    def escalates(self, level: str, confidence: Optional[float]) -> bool:
+        # True when a low model confidence raises `level` (never lowers it)
+        c = self.confidence
+        return (c is not None and confidence is not None and confidence < c.below
+                and LEVEL_ORDER.index(c.level) > LEVEL_ORDER.index(level))
+
+
+def version_key(version: str) -> str:
+    # "2026.10.1+0703cb0b" -> "0703cb0b"; versions without a content hash are used as-is
+    return version.rsplit("+", 1)[-1]
+
+
+def _register_version(version: str, reasons: Tuple[str, ...]) -> None:
+    key = version_key(version)
+    with _versions_lock:
+        _VERSIONS[key] = (version, reasons)
+        _VERSIONS.move_to_end(key)
+        while len(_VERSIONS) > MAX_VERSIONS:
+            _VERSIONS.popitem(last=False)
+
+
+def resolve_version(version: str) -> Tuple[str, Tuple[str, ...]]:
+    # Full version or content hash -> (full version, reason texts); raises
+    # KeyError for versions this process has not loaded (recently)
+    entry = _VERSIONS.get(version_key(version))
+    if entry is None:
+        rules = current_rules()  # loads the configured file on first use
+        if version_key(rules.version) != version_key(version):
+            raise KeyError(version)
+        entry = (rules.version, rules.reasons)
+    return entry
+
+
+def reasons_for_version(version: str) -> Tuple[str, ...]:
+    return resolve_version(version)[1]
+
+
+# -----------------------------
+# Config file -> RuleSet
+# -----------------------------
+def compile_rules(config: Dict[str, Any], digest: str = "") -> RuleSet:
+    # Raises ValueError describing the first problem found; a bad file is never half-applied
+    if not isinstance(config, dict):
+        raise ValueError("rules config must be a JSON object")
+    version = config.get("version")
+    if not isinstance(version, str) or not version.strip():
+        raise ValueError("'version' must be a non-empty string")
+
+    keywords = config.get("keywords")
+    if not isinstance(keywords, dict) or not keywords:
+        raise ValueError("'keywords' must map flag names to phrase lists")
+    for flag, phrases in keywords.items():
+        if not isinstance(phrases, list) or not all(isinstance(p, str) and p.strip() for p in phrases):
+            raise ValueError(f"keywords['{flag}'] must be a list of non-empty strings")
+    keywords = {flag: [p.lower() for p in phrases] for flag, phrases in keywords.items()}
+
+    thresholds = config.get("thresholds") or {}
+    urgent, clinic = thresholds.get("URGENT"), thresholds.get("CLINIC")
+    if not isinstance(urgent, int) or not isinstance(clinic, int):
+        raise ValueError("'thresholds' must give integer URGENT and CLINIC scores")
+    if clinic > urgent:
+        raise ValueError("CLINIC threshold must not exceed URGENT threshold")
+
+    raw_rules = config.get("rules")
+    if not isinstance(raw_rules, list) or not raw_rules:
+        raise ValueError("'rules' must be a non-empty list")
+    rules = []
+    for n, raw in enumerate(raw_rules, start=1):
+        if not isinstance(raw, dict):
+            raise ValueError(f"rule {n}: must be an object")
+        unknown = set(raw) - RULE_FIELDS
+        if unknown:
+            raise ValueError(f"rule {n}: unknown field(s) {sorted(unknown)}")
+        weight, reason = raw.get("weight"), raw.get("reason")
+        if not isinstance(weight, int) or isinstance(weight, bool):
+            raise ValueError(f"rule {n}: 'weight' must be an integer")
+        if not isinstance(reason, str) or not reason.strip():
+            raise ValueError(f"rule {n}: 'reason' must be a non-empty string")
+        any_of, all_of = tuple(raw.get("any_of") or ()), tuple(raw.get("all_of") or ())
+        if bool(any_of) == bool(all_of):
+            raise ValueError(f"rule {n}: give exactly one of 'any_of' or 'all_of'")
+        for s in any_of + all_of:
+            if not isinstance(s, str):
+                raise ValueError(f"rule {n}: signals must be strings")
+            if s.startswith("flag:") and s[len("flag:"):] not in keywords:
+                raise ValueError(f"rule {n}: '{s}' has no entry in 'keywords'")
+            if not (s.startswith(("flag:", "answer:")) or s in DEMOGRAPHIC_SIGNALS):
+                raise ValueError(f"rule {n}: unknown signal '{s}'")
+        rules.append(Rule(weight, reason, any_of, all_of))
+
+    confidence = None
+    raw_conf = config.get("confidence")
+    if raw_conf is not None:
+        if not isinstance(raw_conf, dict) or set(raw_conf) - {"below", "level", "reason"}:
+            raise ValueError("'confidence' must be an object with 'below', 'level' and 'reason'")
+        below, level, reason = raw_conf.get("below"), raw_conf.get("level"), raw_conf.get("reason")
+        if isinstance(below, bool) or not isinstance(below, (int, float)) or not 0 < below <= 1:
+            raise ValueError("confidence: 'below' must be a probability in (0, 1]")
+        if level not in LEVEL_ORDER[1:]:
+            raise ValueError(f"confidence: 'level' must be one of {list(LEVEL_ORDER[1:])}")
+        if not isinstance(reason, str) or not reason.strip():
+            raise ValueError("confidence: 'reason' must be a non-empty string")
+        confidence = ConfidenceRule(float(below), level, reason)
+
+    # The content hash makes the recorded version unambiguous even if an edit
+    # was saved without bumping "version"
+    return RuleSet(f"{version}+{digest[:8]}" if digest else version, keywords, rules, urgent, clinic, confidence)
+
+
+def load_rules(path: str = RULES_PATH) -> RuleSet:
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        config = json.loads(raw.decode("utf-8"))
+    except ValueError as exc:
+        raise ValueError(f"{path}: not valid JSON ({exc})") from None
+    return compile_rules(config, hashlib.sha256(raw).hexdigest())
+
+
+# -----------------------------
+# Hot reload
+# -----------------------------
+# Holds the active RuleSet and swaps in a new one when the file changes on disk.
+# The swap is a single reference assignment, so readers never see a partially
+# loaded version; a file that fails to load leaves the previous version active.
+class RuleStore:
+    def __init__(self, path: str = RULES_PATH, check_interval_s: float = RELOAD_CHECK_S):
+        self.path = path
+        self.check_interval_s = check_interval_s
+        self.last_error: Optional[str] = None
+        self._stamp = self._file_stamp()
+        self._rules = load_rules(path)
+        self._next_check = time.monotonic() + check_interval_s
+        self._reload_lock = threading.Lock()
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        st = os.stat(self.path)
+        return st.st_mtime_ns, st.st_size
+
+    def current(self) -> RuleSet:
+        if time.monotonic() >= self._next_check:
+            self.reload()
+        return self._rules
+
+    def reload(self, force: bool = False) -> bool:
+        # -> True when a new version was swapped in. Only one caller checks at a
+        # time; everyone else keeps using the current version meanwhile.
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = time.monotonic() + self.check_interval_s
+            try:
+                stamp = self._file_stamp()
+                if stamp == self._stamp and not force:
+                    return False
+                self._stamp = stamp  # a broken file is reported once, not on every check
+                rules = load_rules(self.path)
+            except (OSError, ValueError) as exc:
+                if str(exc) != self.last_error:
+                    print(f"⚠️ Keeping triage rules {self._rules.version}: {exc}", file=sys.stderr)
+                self.last_error = str(exc)
+                inc("healthmate_rules_reload_total", help="Rule file reload attempts by result.", result="error")
+                return False
+            self.last_error = None
+            if rules.version == self._rules.version:
+                return False
+            self._rules = rules
+            inc("healthmate_rules_reload_total", help="Rule file reload attempts by result.", result="ok")
+            return True
+        finally:
+            self._reload_lock.release()
+
+
+_store: Optional[RuleStore] = None
+_store_lock = threading.RLock()
+
+
+def use_rules_file(path: str, check_interval_s: float = RELOAD_CHECK_S) -> RuleStore:
+    # Point the process at a different rules file (e.g. server.py --rules)
+    global _store
+    store = RuleStore(path, check_interval_s)
+    with _store_lock:
+        _store = store
+    add_collector("rules", lambda: [("healthmate_rules_info", "gauge", {"version": store.current().version}, 1)])
+    return store
+
+
+def current_rules() -> RuleSet:
+    store = _store
+    if store is None:
+        with _store_lock:
+            store = _store or use_rules_file(RULES_PATH)
+    return store.current()
+
+
+if __name__ == "__main__":
+    # Validate a rules file before deploying it: python triage_rules.py [path]
+    path = sys.argv[1] if len(sys.argv) > 1 else RULES_PATH
+    try:
+        rs = load_rules(path)
+    except (OSError, ValueError) as exc:
+        print(f"❌ {exc}")
+        sys.exit(1)
+    print(f"✅ {path}: version {rs.version}, {len(rs.rules)} rules, {len(rs.keywords)} keyword flags, "
+          f"thresholds URGENT≥{rs.urgent_score} CLINIC≥{rs.clinic_score}"
+          + (f", model confidence <{rs.confidence.below:g} → {rs.confidence.level}" if rs.confidence else ""))